@@ -0,0 +1,64 @@
+import os
+import sys
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from xmlrcp import xmlrpc_utilities  # noqa: E402
+from xmlrcp import binary_utilities  # noqa: E402
+from timing import measure  # noqa: E402
+
+
+def build_payloads():
+    return [
+        ("ints", list(range(10000))),
+        ("doubles", [i / 7 for i in range(10000)]),
+        ("strings", ["elemento numero %d" % i for i in range(5000)]),
+        ("structs", [
+            {
+                "id": i,
+                "nombre": "usuario%d" % i,
+                "puntaje": i * 1.5,
+                "activo": i % 2 == 0,
+                "alta": datetime(2024, 1, 1 + i % 28),
+            }
+            for i in range(2000)
+        ]),
+        ("anidado", [[[i, [i + 1, {"v": i}]]] for i in range(2000)]),
+    ]
+
+
+CODECS = [
+    (
+        "xml",
+        xmlrpc_utilities.write_xmlrpc_response,
+        xmlrpc_utilities.read_xmlrpc_response
+    ),
+    (
+        "binario",
+        binary_utilities.write_binary_response,
+        binary_utilities.read_binary_response
+    ),
+]
+
+
+def main():
+    print(
+        f"{'payload':<10}{'codec':<10}{'bytes':>10}"
+        f"{'codificar (ms)':>17}{'decodificar (ms)':>19}"
+    )
+    for name, payload in build_payloads():
+        for codec, write, read in CODECS:
+            data = write(payload)
+            assert read(data)["data"] == payload
+            encode = measure(lambda: write(payload))
+            decode = measure(lambda: read(data))
+            print(
+                f"{name:<10}{codec:<10}{len(data):>10}"
+                f"{encode * 1e3:>17.2f}{decode * 1e3:>19.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
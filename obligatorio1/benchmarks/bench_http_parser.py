@@ -0,0 +1,56 @@
+import os
+import sys
+import importlib.util
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from xmlrcp import http_utilities  # noqa: E402
+from xmlrcp import xmlrpc_utilities  # noqa: E402
+from timing import measure  # noqa: E402
+
+# La version entregada en todo/ conserva el parser original, que se usa
+# como referencia para comparar.
+LEGACY_PATH = os.path.join(BASE_DIR, "todo", "xmlrcp", "http_utilities.py")
+
+SIZES = [10, 1000, 100000]
+
+
+def load_legacy():
+    spec = importlib.util.spec_from_file_location("legacy_http", LEGACY_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_request(size):
+    data = xmlrpc_utilities.write_xmlrpc_request((list(range(size)), ), "echo")
+    return http_utilities.wrap_http_request(data, "Agente")
+
+
+def build_response(size):
+    data = xmlrpc_utilities.write_xmlrpc_response(list(range(size)))
+    return http_utilities.wrap_http_response(data, 200, "Benchmark")
+
+
+def main():
+    legacy = load_legacy()
+    print(f"{'mensaje':<10}{'bytes':>10}{'original (s)':>16}{'nuevo (s)':>14}{'mejora':>10}")
+    for size in SIZES:
+        cases = [
+            ("request", build_request(size), "unwrap_http_request"),
+            ("response", build_response(size), "unwrap_http_response"),
+        ]
+        for name, data, function in cases:
+            original = getattr(legacy, function)
+            new = getattr(http_utilities, function)
+            before = measure(lambda: original(data))
+            after = measure(lambda: new(data))
+            print(
+                f"{name:<10}{len(data):>10}{before:>16.6f}{after:>14.6f}"
+                f"{before / after:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import importlib.util
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from xmlrcp import http_utilities  # noqa: E402
+from xmlrcp import xmlrpc_utilities  # noqa: E402
+from timing import measure  # noqa: E402
+
+# La version entregada en todo/ arma cada response desde cero, y se usa
+# como referencia para comparar.
+LEGACY_DIR = os.path.join(BASE_DIR, "todo", "xmlrcp")
+
+SERVER_NAME = "PythonPrueba/1.1.1"
+
+# Responses que genera el trafico de todo/evil_client.py: faults de XML
+# mal formado y errores HTTP sin cuerpo, ademas del resto de los faults.
+CASES = [
+    ("fault 1", 200, 1),
+    ("fault 2", 200, 2),
+    ("fault 3", 200, 3),
+    ("fault 4", 200, 4),
+    ("http 400", 400, None),
+    ("http 501", 501, None),
+    ("http 505", 505, None),
+]
+
+# Proporcion de cada caso en el trafico de evil_client.py.
+EVIL_MIX = [("fault 1", 4), ("http 400", 2)]
+
+
+def load_legacy(name):
+    path = os.path.join(LEGACY_DIR, name + ".py")
+    spec = importlib.util.spec_from_file_location("legacy_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_response(http, xmlrpc, code, fault):
+    data = b"" if fault is None else xmlrpc.write_xmlrpc_error(fault)
+    return http.wrap_http_response(data, code, SERVER_NAME)
+
+
+def main():
+    legacy = (load_legacy("http_utilities"), load_legacy("xmlrpc_utilities"))
+    current = (http_utilities, xmlrpc_utilities)
+
+    results = {}
+    print(f"{'response':<10}{'original (us)':>16}{'nuevo (us)':>14}{'mejora':>10}")
+    for name, code, fault in CASES:
+        before = measure(lambda: build_response(*legacy, code, fault))
+        after = measure(lambda: build_response(*current, code, fault))
+        results[name] = (before, after)
+        print(
+            f"{name:<10}{before * 1e6:>16.2f}{after * 1e6:>14.2f}"
+            f"{before / after:>9.1f}x"
+        )
+
+    # Costo promedio por response del trafico de evil_client.py.
+    total = sum(count for _, count in EVIL_MIX)
+    before = sum(results[name][0] * count for name, count in EVIL_MIX) / total
+    after = sum(results[name][1] * count for name, count in EVIL_MIX) / total
+    print(
+        f"{'evil mix':<10}{before * 1e6:>16.2f}{after * 1e6:>14.2f}"
+        f"{before / after:>9.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
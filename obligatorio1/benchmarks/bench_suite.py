@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import multiprocessing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from xmlrcp import Server, connect  # noqa: E402
+from xmlrcp import http_utilities  # noqa: E402
+from xmlrcp import xmlrpc_utilities  # noqa: E402
+from timing import measure  # noqa: E402
+
+# Benchmark reproducible de xmlrcp. Levanta un servidor en localhost en
+# otro proceso y lo carga con 'concurrency' procesos cliente para cada
+# forma de payload, midiendo throughput y latencias, y ademas mide por
+# separado cada etapa del procesamiento de un request. Los resultados se
+# guardan en JSON, y con --baseline se comparan con los de otra version.
+
+MODES = ["serve", "serve_pool", "serve_async"]
+
+
+def suma(arg1, arg2):
+    return arg1 + arg2
+
+
+def eco(arg):
+    return arg
+
+
+def build_struct(depth):
+    ret = {"hoja": 1, "nombre": "nivel"}
+    for level in range(depth):
+        ret = {"nivel": level, "nombre": "nivel", "hijo": ret}
+    return ret
+
+
+# Formas de payload: el metodo y los parametros de cada llamada.
+def build_payloads(array_size, struct_depth):
+    return {
+        "scalars": ("suma", (1, 2)),
+        "array": ("eco", (list(range(array_size)), )),
+        "struct": ("eco", (build_struct(struct_depth), )),
+    }
+
+
+# -------------------
+# |      Carga      |
+# -------------------
+
+
+def run_server(mode, conn):
+    server = Server(("localhost", 0))
+    server.queue_length = 128
+    server.sock.listen(server.queue_length)
+    server.add_method(suma)
+    server.add_method(eco)
+    conn.send(server.sock.getsockname()[1])
+    conn.close()
+    getattr(server, mode)()
+
+
+def start_server(mode):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=run_server,
+        args=(mode, child),
+        daemon=True
+    )
+    process.start()
+    port = parent.recv()
+    return process, port
+
+
+# Ejecuta las llamadas de un proceso cliente y retorna las latencias de
+# las que terminaron bien, la cantidad de errores (las llamadas que
+# levantan una excepcion, incluidas las de calentamiento), y el principio
+# y fin de la medicion.
+def run_client(port, method, params, requests, warmup, options):
+    client = connect("localhost", port)
+    client.OPERATIONAL_TIME = 30
+    for name, value in options.items():
+        setattr(client, name, value)
+
+    errors = 0
+    for _ in range(warmup):
+        try:
+            client.call(method, params)
+        except Exception:
+            errors += 1
+
+    latencies = []
+    start = time.monotonic()
+    for _ in range(requests):
+        before = time.perf_counter()
+        try:
+            client.call(method, params)
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - before)
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "start": start,
+        "end": time.monotonic()
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_load(mode, payload, method, params, concurrency, args, options):
+    process, port = start_server(mode)
+    try:
+        with multiprocessing.Pool(concurrency) as pool:
+            results = pool.starmap(run_client, [
+                (port, method, params, args.requests, args.warmup, options)
+            ] * concurrency)
+    finally:
+        process.terminate()
+        process.join()
+
+    latencies = sorted(
+        latency for result in results for latency in result["latencies"]
+    )
+    elapsed = (
+        max(result["end"] for result in results) -
+        min(result["start"] for result in results)
+    )
+    return {
+        "mode": mode,
+        "payload": payload,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "p999": percentile(latencies, 0.999),
+    }
+
+
+# -------------------
+# |     Etapas      |
+# -------------------
+
+
+# Tiempo en segundos de cada etapa del procesamiento de un request, para
+# cada forma de payload.
+def run_stages(payloads):
+    server = Server(("localhost", 0))
+    server.add_method(suma)
+    server.add_method(eco)
+
+    stages = {}
+    try:
+        for payload, (method, params) in payloads.items():
+            body = xmlrpc_utilities.write_xmlrpc_request(params, method)
+            http_req = http_utilities.wrap_http_request(body, "Benchmark")
+            result = server.methods[method]["function"](*params)
+            response = xmlrpc_utilities.write_xmlrpc_response(result)
+
+            def dispatch():
+                found = server.find_method(method, list(params))
+                server.execute(found["method"]["function"], params)
+
+            stages[payload] = {
+                "http_parse": measure(
+                    lambda: http_utilities.unwrap_http_request(http_req)
+                ),
+                "xml_encode_request": measure(
+                    lambda: xmlrpc_utilities.write_xmlrpc_request(
+                        params,
+                        method
+                    )
+                ),
+                "xml_decode_request": measure(
+                    lambda: xmlrpc_utilities.read_xmlrpc_request(body)
+                ),
+                "xml_encode_response": measure(
+                    lambda: xmlrpc_utilities.write_xmlrpc_response(result)
+                ),
+                "xml_decode_response": measure(
+                    lambda: xmlrpc_utilities.read_xmlrpc_response(response)
+                ),
+                "dispatch": measure(dispatch),
+                "process_request": measure(
+                    lambda: server.process_request(http_req)
+                ),
+            }
+    finally:
+        server.shutdown()
+    return stages
+
+
+# -------------------
+# |   Comparacion   |
+# -------------------
+
+
+# Compara los resultados con los de 'baseline' y retorna las regresiones
+# mayores a 'tolerance' (fraccion): menos throughput, mas latencia p99, o
+# mas tiempo en alguna etapa.
+def compare(results, baseline, tolerance):
+    regressions = []
+    previous = {
+        (entry["mode"], entry["payload"], entry["concurrency"]): entry
+        for entry in baseline.get("load", [])
+    }
+    for entry in results["load"]:
+        key = (entry["mode"], entry["payload"], entry["concurrency"])
+        old = previous.get(key)
+        if old is None:
+            continue
+        if old["throughput"] and entry["throughput"] is not None:
+            if entry["throughput"] < old["throughput"] * (1 - tolerance):
+                regressions.append((key, "throughput", old["throughput"],
+                                    entry["throughput"]))
+        if old["p99"] and entry["p99"] is not None:
+            if entry["p99"] > old["p99"] * (1 + tolerance):
+                regressions.append((key, "p99", old["p99"], entry["p99"]))
+
+    for payload, stages in results["stages"].items():
+        for stage, value in stages.items():
+            old = baseline.get("stages", {}).get(payload, {}).get(stage)
+            if old and value > old * (1 + tolerance):
+                regressions.append((payload, stage, old, value))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de xmlrcp.")
+    parser.add_argument("--modes", nargs="+", default=["serve"],
+                        choices=MODES)
+    parser.add_argument("--payloads", nargs="+",
+                        default=["scalars", "array", "struct"],
+                        choices=["scalars", "array", "struct"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests por proceso cliente")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--array-size", type=int, default=10000)
+    parser.add_argument("--struct-depth", type=int, default=50)
+    parser.add_argument("--binary", action="store_true",
+                        help="usar la codificacion binaria")
+    parser.add_argument("--gzip", action="store_true",
+                        help="aceptar responses comprimidos")
+    parser.add_argument("--no-keep-alive", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-stages", action="store_true")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    parser.add_argument("--baseline", help="JSON de otra version a comparar")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    payloads = build_payloads(args.array_size, args.struct_depth)
+    payloads = {name: payloads[name] for name in args.payloads}
+    options = {
+        "binary": args.binary,
+        "accept_encoding": "gzip" if args.gzip else None,
+        "keep_alive": not args.no_keep_alive,
+    }
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "load": [],
+        "stages": {},
+    }
+
+    if not args.skip_load:
+        for mode in args.modes:
+            for payload, (method, params) in payloads.items():
+                for concurrency in args.concurrency:
+                    entry = run_load(mode, payload, method, params,
+                                     concurrency, args, options)
+                    results["load"].append(entry)
+                    print(
+                        f"{mode:<12}{payload:<9}c={concurrency:<4}"
+                        f"{entry['throughput'] or 0:>9.1f} req/s"
+                        f"  p50={(entry['p50'] or 0) * 1e3:.2f}ms"
+                        f"  p99={(entry['p99'] or 0) * 1e3:.2f}ms"
+                        f"  p999={(entry['p999'] or 0) * 1e3:.2f}ms"
+                        f"  errores={entry['errors']}",
+                        file=sys.stderr
+                    )
+
+    if not args.skip_stages:
+        results["stages"] = run_stages(payloads)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("regresion:", *regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+import os
+import sys
+import json
+import time
+import zlib
+import socket
+import struct
+import bisect
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from xmlrcp import http_utilities  # noqa: E402
+from xmlrcp import xmlrpc_utilities  # noqa: E402
+from xmlrcp import binary_utilities  # noqa: E402
+from xmlrcp import socket_functions  # noqa: E402
+
+# Reproduce contra un servidor los requests XMLRPC de una captura (pcap o
+# pcapng, por ejemplo de tcpdump o Wireshark), respetando los tiempos
+# entre ellos escalados por --speed. Reporta la distribucion de las
+# latencias y los responses que difieren de los capturados. Las
+# conexiones TCP se rearman a partir de los paquetes, por lo que los
+# mensajes pueden estar repartidos en varios segmentos o retransmitidos.
+
+USER_AGENT = "Replay"
+
+# Tamaño maximo en bytes de los responses del servidor; los mas grandes
+# se cuentan como error sin reservar memoria para ellos.
+MAX_RESPONSE_SIZE = 64 * 1024 * 1024
+
+# Tipos de enlace soportados ademas de Ethernet, y el largo de su header.
+# El protocolo de red se obtiene de la version del paquete IP.
+LINK_ETHERNET = 1
+LINK_HEADERS = {
+    0: 4,       # loopback de BSD.
+    101: 0,     # IP sin header de enlace.
+    108: 4,     # loopback de OpenBSD.
+    113: 16,    # Linux cooked capture (SLL).
+    228: 0,     # IPv4.
+    229: 0,     # IPv6.
+    276: 20,    # Linux cooked capture v2 (SLL2).
+}
+
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_SECTION = b"\x0a\x0d\x0d\x0a"
+
+TCP_SYN = 0x02
+
+
+# -------------------
+# |     Lectura     |
+# |       de        |
+# |     Capturas    |
+# -------------------
+
+
+# Generador de los paquetes de un archivo pcap, como (tiempo, tipo de
+# enlace, datos).
+def read_pcap(data):
+    order, resolution = PCAP_MAGICS[data[:4]]
+    link = struct.unpack_from(order + "I", data, 20)[0]
+    record = struct.Struct(order + "IIII")
+    pos = 24
+    while pos + record.size <= len(data):
+        seconds, fraction, size, _ = record.unpack_from(data, pos)
+        pos += record.size
+        yield seconds + fraction * resolution, link, data[pos:pos + size]
+        pos += size
+
+
+# Generador de los paquetes de un archivo pcapng, con la misma forma que
+# read_pcap. Solo se leen los Enhanced Packet Blocks, que son los que
+# tienen el tiempo de cada paquete.
+def read_pcapng(data):
+    pos = 0
+    order = "<"
+    interfaces = []
+    while pos + 12 <= len(data):
+        kind = data[pos:pos + 4]
+        if kind == PCAPNG_SECTION:
+            magic = data[pos + 8:pos + 12]
+            order = "<" if magic == b"\x4d\x3c\x2b\x1a" else ">"
+            interfaces = []
+        kind, size = struct.unpack_from(order + "II", data, pos)
+        if size < 12:
+            return
+        body = data[pos + 8:pos + size - 4]
+        pos += size
+
+        if kind == 1:
+            # Interface Description Block: tipo de enlace y resolucion
+            # de los tiempos (opcion if_tsresol).
+            link = struct.unpack_from(order + "H", body)[0]
+            resolution = 1e-6
+            option = 8
+            while option + 4 <= len(body):
+                code, length = struct.unpack_from(order + "HH", body, option)
+                if code == 0:
+                    break
+                if code == 9 and length >= 1:
+                    value = body[option + 4]
+                    if value & 0x80:
+                        resolution = 2.0 ** -(value & 0x7f)
+                    else:
+                        resolution = 10.0 ** -value
+                option += 4 + (length + 3) // 4 * 4
+            interfaces.append((link, resolution))
+        elif kind == 6 and interfaces:
+            # Enhanced Packet Block.
+            interface, high, low, captured, _ = struct.unpack_from(
+                order + "IIIII",
+                body
+            )
+            link, resolution = interfaces[interface]
+            stamp = ((high << 32) | low) * resolution
+            yield stamp, link, body[20:20 + captured]
+
+
+def read_capture(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:4] == PCAPNG_SECTION:
+        return read_pcapng(data)
+    if data[:4] in PCAP_MAGICS:
+        return read_pcap(data)
+    raise Exception("Formato de captura desconocido.")
+
+
+# Retorna el paquete IP de un paquete de enlace 'link', o None si no es IP.
+def ip_packet(link, frame):
+    if link == LINK_ETHERNET:
+        pos = 12
+        kind = frame[pos:pos + 2]
+        while kind in (b"\x81\x00", b"\x88\xa8"):
+            pos += 4
+            kind = frame[pos:pos + 2]
+        if kind not in (b"\x08\x00", b"\x86\xdd"):
+            return None
+        return frame[pos + 2:]
+    if link in LINK_HEADERS:
+        return frame[LINK_HEADERS[link]:]
+    return None
+
+
+# Retorna el segmento TCP de un paquete IP como (origen, destino,
+# numero de secuencia, flags, datos), donde origen y destino son
+# (direccion, puerto), o None si no es TCP.
+def tcp_segment(packet):
+    if not packet:
+        return None
+    version = packet[0] >> 4
+    if version == 4:
+        if packet[9] != 6:
+            return None
+        start = (packet[0] & 0x0f) * 4
+        end = struct.unpack_from(">H", packet, 2)[0]
+        source = socket.inet_ntop(socket.AF_INET, packet[12:16])
+        destination = socket.inet_ntop(socket.AF_INET, packet[16:20])
+    elif version == 6:
+        if packet[6] != 6:
+            return None
+        start = 40
+        end = 40 + struct.unpack_from(">H", packet, 4)[0]
+        source = socket.inet_ntop(socket.AF_INET6, packet[8:24])
+        destination = socket.inet_ntop(socket.AF_INET6, packet[24:40])
+    else:
+        return None
+
+    segment = packet[start:end]
+    if len(segment) < 20:
+        return None
+    sport, dport, seq = struct.unpack_from(">HHI", segment)
+    offset = (segment[12] >> 4) * 4
+    flags = segment[13]
+    return (source, sport), (destination, dport), seq, flags, segment[offset:]
+
+
+# Rearma los flujos TCP de la captura. Retorna una lista de flujos, cada
+# uno con su origen, destino, los datos en orden y la lista de (posicion,
+# tiempo) en la que llego cada parte. Un SYN inicia un flujo nuevo entre
+# los mismos extremos.
+def read_streams(packets):
+    streams = []
+    current = {}
+    for stamp, link, frame in packets:
+        segment = tcp_segment(ip_packet(link, frame))
+        if segment is None:
+            continue
+        source, destination, seq, flags, payload = segment
+        key = (source, destination)
+        stream = current.get(key)
+        syn = flags & TCP_SYN
+        base = (seq + 1) & 0xffffffff
+        if stream is None or (syn and stream["base"] != base):
+            stream = {
+                "source": source,
+                "destination": destination,
+                "base": None,
+                "segments": []
+            }
+            current[key] = stream
+            streams.append(stream)
+        if syn:
+            stream["base"] = base
+        if payload:
+            if stream["base"] is None:
+                stream["base"] = seq
+            relative = (seq - stream["base"]) & 0xffffffff
+            stream["segments"].append((relative, stamp, payload))
+
+    # Los segmentos se ordenan y se descartan las retransmisiones. Si
+    # falta una parte el flujo termina ahi.
+    for stream in streams:
+        data = bytearray()
+        times = []
+        for relative, stamp, payload in sorted(
+            stream.pop("segments"),
+            key=lambda segment: (segment[0], segment[1])
+        ):
+            if relative > len(data):
+                break
+            if relative + len(payload) <= len(data):
+                continue
+            times.append((len(data), stamp))
+            data += payload[len(data) - relative:]
+        stream["data"] = bytes(data)
+        stream["times"] = times
+    return streams
+
+
+# Separa los mensajes HTTP consecutivos de un flujo que comienzan con
+# 'start', retornando cada uno con el tiempo en que llego su inicio.
+def split_messages(stream, start):
+    data = stream["data"]
+    positions = [position for position, _ in stream["times"]]
+    messages = []
+    pos = 0
+    while data.startswith(start, pos):
+        size = http_utilities.message_length(data[pos:])
+        if size is None or pos + size > len(data):
+            break
+        index = max(bisect.bisect_right(positions, pos) - 1, 0)
+        messages.append({
+            "time": stream["times"][index][1],
+            "data": data[pos:pos + size]
+        })
+        pos += size
+    return messages
+
+
+# Retorna los requests XMLRPC de la captura en orden de llegada, con el
+# response capturado de cada uno si lo hay. Con 'port' y 'host' solo se
+# toman las conexiones a ese puerto y a esa direccion, por ejemplo para
+# separar los servidores de una captura que tiene varios en el mismo
+# puerto.
+def read_calls(path, port=None, host=None):
+    streams = read_streams(read_capture(path))
+    directions = {}
+    for index, stream in enumerate(streams):
+        key = (stream["source"], stream["destination"])
+        directions.setdefault(key, []).append(index)
+
+    calls = []
+    for index, stream in enumerate(streams):
+        if port is not None and stream["destination"][1] != port:
+            continue
+        if host is not None and stream["destination"][0] != host:
+            continue
+        requests = split_messages(stream, b"POST ")
+        if not requests:
+            continue
+
+        # El flujo de respuesta es el siguiente en sentido contrario.
+        responses = []
+        others = directions.get((stream["destination"], stream["source"]), [])
+        position = bisect.bisect_right(others, index)
+        if position < len(others):
+            responses = split_messages(streams[others[position]], b"HTTP/")
+        for position, request in enumerate(requests):
+            request["response"] = None
+            if position < len(responses):
+                request["response"] = responses[position]["data"]
+            calls.append(request)
+    calls.sort(key=lambda call: call["time"])
+    return calls
+
+
+# -------------------
+# |   Reproduccion  |
+# -------------------
+
+
+# Retorna el valor del header 'name' de un bloque de headers, o None.
+def header_value(head, name):
+    for line in head.split(http_utilities.CRLF_BYTES)[1:]:
+        key, _, value = line.partition(b":")
+        if key.strip().lower() == name.lower():
+            return value.strip().decode("latin-1")
+    return None
+
+
+# Separa un mensaje HTTP en sus headers y su cuerpo, descomprimido si
+# tiene Content-Encoding.
+def split_message(message):
+    end = message.find(http_utilities.HEAD_END)
+    head = message[:end]
+    body = message[end + len(http_utilities.HEAD_END):]
+    encoding = header_value(head, b"Content-Encoding")
+    if encoding in http_utilities.CONTENT_ENCODINGS:
+        body = zlib.decompress(
+            body,
+            http_utilities.CONTENT_ENCODINGS[encoding]
+        )
+    return head, body
+
+
+# Retorna el request a enviar para un mensaje capturado. Salvo con 'raw'
+# el cuerpo se vuelve a envolver con los headers de xmlrcp, ya que los de
+# otros clientes pueden no ser aceptados por el servidor.
+def build_request(message, raw):
+    if raw:
+        return message
+    end = message.find(http_utilities.HEAD_END)
+    head = message[:end]
+    body = message[end + len(http_utilities.HEAD_END):]
+    encoding = header_value(head, b"Content-Encoding")
+    if encoding not in http_utilities.CONTENT_ENCODINGS:
+        encoding = None
+    content_type = header_value(head, b"Content-Type")
+    if content_type not in http_utilities.CONTENT_TYPES:
+        content_type = http_utilities.XML_CONTENT_TYPE
+    return http_utilities.wrap_http_request(
+        body,
+        USER_AGENT,
+        encoding=encoding,
+        content_type=content_type
+    )
+
+
+# Decodifica un HTTP response para compararlo: su codigo y el valor
+# XMLRPC (o el cuerpo, si no se puede decodificar). Si el cuerpo no se
+# puede descomprimir se retorna el error como valor, para que se reporte
+# como una diferencia.
+def response_value(message):
+    head = message[:message.find(http_utilities.HEAD_END)]
+    code = head.split(b" ", 2)[1:2]
+    try:
+        head, body = split_message(message)
+    except zlib.error as ex:
+        return code, {"compresion invalida": str(ex)}
+    try:
+        if header_value(head, b"Content-Type") == \
+                http_utilities.BINARY_CONTENT_TYPE:
+            value = binary_utilities.read_binary_response(body)
+        else:
+            value = xmlrpc_utilities.read_xmlrpc_response(body)
+    except Exception:
+        value = body
+    return code, value
+
+
+def method_name(message):
+    try:
+        _, body = split_message(message)
+        return xmlrpc_utilities.read_xmlrpc_request(body)["method"]
+    except Exception:
+        return None
+
+
+# Envia un request en una conexion nueva y retorna el response y la
+# latencia, o el error.
+def send_call(address, port, data, timeout):
+    start = time.perf_counter()
+    try:
+        conn = socket.create_connection((address, port), timeout)
+        try:
+            conn.settimeout(timeout)
+            sended = socket_functions.send_socket(conn, data)
+            if not sended["status"]:
+                return {"status": False, "error": "envio"}
+            readed = socket_functions.read_message(
+                conn,
+                65536,
+                MAX_RESPONSE_SIZE
+            )
+        finally:
+            conn.close()
+    except OSError as ex:
+        return {"status": False, "error": str(ex)}
+    if readed["too_large"]:
+        return {"status": False, "error": "response demasiado grande"}
+    if not readed["status"] or not readed["data"]:
+        return {"status": False, "error": "sin response"}
+    return {
+        "status": True,
+        "data": bytes(readed["data"]),
+        "latency": time.perf_counter() - start
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Reproduce las llamadas respetando el tiempo entre ellas dividido por
+# 'speed' (con 0, sin esperas), con a lo sumo 'concurrency' en curso.
+def replay(calls, args):
+    requests = [build_request(call["data"], args.raw) for call in calls]
+    first = calls[0]["time"]
+    results = [None] * len(calls)
+    lags = []
+
+    def run(index):
+        results[index] = send_call(
+            args.host,
+            args.port,
+            requests[index],
+            args.timeout
+        )
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for index, call in enumerate(calls):
+            if args.speed:
+                scheduled = start + (call["time"] - first) / args.speed
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lags.append(-delay)
+            executor.submit(run, index)
+    elapsed = time.monotonic() - start
+    return results, elapsed, max(lags, default=0)
+
+
+def summarize(calls, results, elapsed, lag, args):
+    latencies = sorted(
+        result["latency"] for result in results if result["status"]
+    )
+    errors = {}
+    mismatches = []
+    for index, (call, result) in enumerate(zip(calls, results)):
+        if not result["status"]:
+            errors[result["error"]] = errors.get(result["error"], 0) + 1
+            continue
+        if call["response"] is None:
+            continue
+        expected = response_value(call["response"])
+        obtained = response_value(result["data"])
+        if expected != obtained:
+            mismatches.append({
+                "index": index,
+                "method": method_name(call["data"]),
+                "expected": repr(expected)[:200],
+                "obtained": repr(obtained)[:200]
+            })
+
+    return {
+        "meta": {
+            "capture": args.capture,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args),
+        },
+        "calls": len(calls),
+        "compared": sum(1 for call in calls if call["response"] is not None),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "max_lag": lag,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "p999": percentile(latencies, 0.999),
+            "max": latencies[-1] if latencies else None,
+        },
+        "errors": errors,
+        "mismatches": len(mismatches),
+        "mismatch_examples": mismatches[:args.examples],
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Reproduce los requests XMLRPC de una captura."
+    )
+    parser.add_argument("capture", help="archivo pcap o pcapng")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, required=True,
+                        help="puerto del servidor contra el que reproducir")
+    parser.add_argument("--capture-port", type=int,
+                        help="solo las conexiones a este puerto en la captura")
+    parser.add_argument("--capture-host",
+                        help="solo las conexiones a esta direccion en la "
+                             "captura")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="factor de velocidad; 0 envia sin esperas")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="veces que se reproduce la captura")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--raw", action="store_true",
+                        help="enviar los requests con sus headers originales")
+    parser.add_argument("--examples", type=int, default=10,
+                        help="cantidad de diferencias a mostrar")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    calls = read_calls(args.capture, args.capture_port, args.capture_host)
+    if not calls:
+        print("La captura no tiene requests XMLRPC.", file=sys.stderr)
+        sys.exit(1)
+
+    # Las repeticiones se encadenan desplazando los tiempos.
+    duration = calls[-1]["time"] - calls[0]["time"]
+    calls = [
+        dict(call, time=call["time"] + round_number * (duration + 1e-3))
+        for round_number in range(args.repeat)
+        for call in calls
+    ]
+
+    results, elapsed, lag = replay(calls, args)
+    summary = summarize(calls, results, elapsed, lag, args)
+    latency = summary["latency"]
+    print(
+        f"{summary['calls']} llamadas en {elapsed:.2f}s"
+        f" ({summary['throughput'] or 0:.1f}/s)"
+        f"  p50={(latency['p50'] or 0) * 1e3:.2f}ms"
+        f"  p99={(latency['p99'] or 0) * 1e3:.2f}ms"
+        f"  p999={(latency['p999'] or 0) * 1e3:.2f}ms"
+        f"  errores={sum(summary['errors'].values())}"
+        f"  diferencias={summary['mismatches']}/{summary['compared']}",
+        file=sys.stderr
+    )
+
+    output = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import timeit
+
+# Medicion de tiempos compartida por los benchmarks.
+
+
+# Tiempo en segundos de una llamada a 'function': el minimo de tres
+# repeticiones, cada una con tantas llamadas como elige timeit.autorange.
+def measure(function):
+    number, _ = timeit.Timer(function).autorange()
+    total = min(timeit.repeat(function, number=number, repeat=3))
+    return total / number
@@ -0,0 +1,43 @@
+import os
+import sys
+import socket
+import time
+import threading
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+# Formas de atender conexiones del servidor con las que se prueban los
+# tests que dependen de ellas.
+MODES = ["serve", "serve_async", "serve_pool"]
+
+
+# Inicia 'server' en un hilo con la forma de atender 'mode' y retorna su
+# puerto. Los hilos son daemon, por lo que terminan junto a los tests.
+@pytest.fixture
+def start_server():
+    def start(server, mode="serve"):
+        port = server.sock.getsockname()[1]
+        threading.Thread(target=getattr(server, mode), daemon=True).start()
+        time.sleep(0.05)
+        return port
+
+    return start
+
+
+# Envia 'data' tal cual en una conexion nueva y retorna el codigo HTTP y
+# los bytes del response.
+def raw_request(port, data):
+    conn = socket.create_connection(("localhost", port), timeout=5)
+    conn.sendall(data)
+    conn.shutdown(socket.SHUT_WR)
+    response = b""
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        response += chunk
+    conn.close()
+    return int(response.split(b" ", 2)[1]), response
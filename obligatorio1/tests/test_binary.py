@@ -0,0 +1,68 @@
+import io
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+from conftest import MODES
+from xmlrcp import Server, connect, XmlRpcException
+from xmlrcp import binary_utilities
+from xmlrcp.xmlrpc_utilities import CHUNK_SIZE
+
+VALUES = [
+    1, -2 ** 31, 2 ** 40, 2 ** 80, 1.5, True, False, "texto ñ", "",
+    b"\x00\xff", b"", datetime(2024, 5, 6, 7, 8, 9),
+    [1, [2, [3, []]]], {"a": {"b": [1, "x"]}, "c": {}},
+]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_round_trip(value):
+    body = binary_utilities.write_binary_request([value], "eco")
+    assert binary_utilities.read_binary_request(body) == {
+        "method": "eco",
+        "params": [value]
+    }
+    body = binary_utilities.write_binary_response(value)
+    assert binary_utilities.read_binary_response(body)["data"] == value
+
+
+def test_files_are_streamed():
+    data = os.urandom(3 * CHUNK_SIZE + 10)
+    with tempfile.TemporaryFile() as file:
+        file.write(data)
+        file.seek(10)
+        parts = list(binary_utilities.iter_binary_request([file], "m"))
+        assert max(len(part) for part in parts) <= CHUNK_SIZE
+        assert file.tell() == 10
+    body = b"".join(parts)
+    assert binary_utilities.read_binary_request(body)["params"] == [data[10:]]
+
+    # Los archivos sin seek se leen completos.
+    file = io.BufferedReader(io.BytesIO(data))
+    file.seekable = lambda: False
+    body = binary_utilities.write_binary_request([file], "m")
+    assert binary_utilities.read_binary_request(body)["params"] == [data]
+
+
+def test_truncated_message_is_rejected():
+    body = binary_utilities.write_binary_request([[1, "dos", b"tres"]], "m")
+    for end in range(len(body)):
+        with pytest.raises(Exception):
+            binary_utilities.read_binary_request(body[:end])
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_binary_calls(start_server, mode):
+    server = Server(("localhost", 0))
+    server.add_method(lambda value: value, name="eco")
+    server.add_method(lambda file: len(file.read()), name="size", files=True)
+    client = connect("localhost", start_server(server, mode))
+    client.binary = True
+    for value in VALUES:
+        assert client.eco(value) == value
+    assert client.size(io.BytesIO(b"x" * 100000)) == 100000
+    with pytest.raises(XmlRpcException) as info:
+        client.eco()
+    assert info.value.code == 3
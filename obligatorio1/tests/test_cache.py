@@ -0,0 +1,29 @@
+import pytest
+
+from xmlrcp import Server, connect
+
+
+def test_cache_hits(start_server):
+    runs = []
+
+    def potencia(base, exponente):
+        runs.append(base)
+        return base ** exponente
+
+    server = Server(("localhost", 0))
+    server.add_method(potencia, cache=True)
+    client = connect("localhost", start_server(server))
+    assert [client.potencia(2, 10) for _ in range(3)] == [1024] * 3
+    assert client.potencia(3, 2) == 9
+    assert runs == [2, 3]
+    assert server.cache_stats()["potencia"]["hits"] == 2
+
+
+@pytest.mark.parametrize("cache", [True, 8])
+def test_cache_rejects_files(cache):
+    server = Server(("localhost", 0))
+    with pytest.raises(TypeError):
+        server.add_method(lambda file: file, name="echof", files=True,
+                          cache=cache)
+    assert "echof" not in server.methods
+    server.sock.close()
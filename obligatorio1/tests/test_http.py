@@ -0,0 +1,85 @@
+import gzip
+
+import pytest
+
+from conftest import MODES, raw_request
+from xmlrcp import Server, connect, wrap_http_request, unwrap_http_response
+from xmlrcp import xmlrpc_utilities
+
+
+def make_server():
+    server = Server(("localhost", 0))
+    server.add_method(lambda a, b: a + b, name="suma")
+    return server
+
+
+def suma_request():
+    body = xmlrpc_utilities.write_xmlrpc_request([1, 2], "suma")
+    return wrap_http_request(body, "pytest")
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_valid_request(start_server, mode):
+    port = start_server(make_server(), mode)
+    code, response = raw_request(port, suma_request())
+    assert code == 200
+    body = unwrap_http_response(response)
+    assert xmlrpc_utilities.read_xmlrpc_response(body)["data"] == 3
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("data, code", [
+    (b"POST /\r\n\r\n", 400),
+    (suma_request().replace(b"User-Agent: ", b"User-Agent:"), 400),
+    (suma_request().replace(b"Content-Length: ", b"Content-Length: x"), 400),
+    (suma_request().replace(b"POST", b"GET", 1), 501),
+    (suma_request().replace(b"text/xml", b"text/html"), 415),
+    (suma_request().replace(b"HTTP/1.1", b"HTTP/2.0", 1), 505),
+])
+def test_invalid_request(start_server, mode, data, code):
+    port = start_server(make_server(), mode)
+    assert raw_request(port, data)[0] == code
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_header_too_large(start_server, mode):
+    server = make_server()
+    port = start_server(server, mode)
+    data = suma_request().replace(
+        b"Accept-Language: en",
+        b"Accept-Language: " + b"x" * server.max_header_size
+    )
+    assert raw_request(port, data)[0] == 413
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_body_too_large(start_server, mode):
+    server = make_server()
+    port = start_server(server, mode)
+
+    # Solo se envian los headers: el request se rechaza sin leer el cuerpo.
+    head = suma_request().split(b"Content-Length: ")[0]
+    head += b"Content-Length: %d\r\n\r\n" % (server.max_body_size + 1)
+    assert raw_request(port, head)[0] == 413
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_gzip_round_trip(start_server, mode):
+    client = connect("localhost", start_server(make_server(), mode))
+    client.compress_min_size = 0
+    client.accept_encoding = "gzip"
+    text = "abc" * 10000
+    assert client.suma(text, text) == text * 2
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_gzip_bomb_rejected(start_server, mode):
+    server = make_server()
+    server.max_body_size = 100000
+    port = start_server(server, mode)
+
+    # Unos pocos KB que se descomprimen a 10 MB.
+    body = xmlrpc_utilities.write_xmlrpc_request(["a" * 10000000, ""], "suma")
+    data = wrap_http_request(gzip.compress(body), "pytest", encoding="gzip")
+    assert len(data) < server.max_body_size
+    assert raw_request(port, data)[0] == 413
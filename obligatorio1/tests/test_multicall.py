@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import MODES
+from xmlrcp import Server, connect, MultiCall, XmlRpcException
+
+
+def multicall_server():
+    server = Server(("localhost", 0))
+    server.add_method(lambda a, b: a + b, name="suma")
+    server.add_method(lambda: 1 / 0, name="falla")
+    server.add_method(lambda file: file, name="echof", files=True)
+    server.add_method(lambda file: len(file.read()), name="size", files=True)
+    return server
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("mode", MODES)
+def test_faults_per_call(start_server, mode, binary):
+    client = connect("localhost", start_server(multicall_server(), mode))
+    client.binary = binary
+    multi = MultiCall(client)
+    multi.suma(1, 2)
+    multi.falla()
+    multi.no_existe()
+    multi.suma(1)
+    multi.suma(2, 3)
+    results = list(multi())
+    assert results[0] == 3
+    assert [ex.code for ex in results[1:4]] == [4, 2, 3]
+    assert results[4] == 5
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("mode", MODES)
+def test_files_method_returns_its_file(start_server, mode, binary):
+    client = connect("localhost", start_server(multicall_server(), mode))
+    client.binary = binary
+    assert client.echof(b"zz") == b"zz"
+
+    multi = MultiCall(client)
+    multi.echof(b"zz")
+    multi.size(b"abc")
+    multi.echof({"nested": [b"x"]})
+    multi.falla()
+    results = list(multi())
+    assert results[:3] == [b"zz", 3, {"nested": [b"x"]}]
+    assert isinstance(results[3], XmlRpcException)
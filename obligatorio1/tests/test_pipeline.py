@@ -0,0 +1,33 @@
+import pytest
+
+from conftest import MODES
+from xmlrcp import Server, connect, Pipeline
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_pipeline_across_keep_alive_max(start_server, mode, capfd):
+    server = Server(("localhost", 0))
+    server.add_method(lambda a, b: a + b, name="suma")
+    server.keep_alive_max = 3
+    pipeline = Pipeline(connect("localhost", start_server(server, mode)))
+    texts = ["x" * 20000 + str(i) for i in range(60)]
+    for text in texts:
+        pipeline.suma(text, "!")
+    assert pipeline() == [text + "!" for text in texts]
+
+    # El cierre de la conexion al llegar a keep_alive_max es esperado y no
+    # se reporta.
+    assert "Broken pipe" not in capfd.readouterr().out
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_pipeline_faults_in_order(start_server, mode):
+    server = Server(("localhost", 0))
+    server.add_method(lambda a, b: a + b, name="suma")
+    pipeline = Pipeline(connect("localhost", start_server(server, mode)))
+    pipeline.suma(1, 2)
+    pipeline.no_existe()
+    pipeline.suma(3, 4)
+    results = pipeline()
+    assert results[0] == 3 and results[2] == 7
+    assert results[1].code == 2
@@ -0,0 +1,86 @@
+import threading
+
+from conftest import raw_request
+from xmlrcp import Server, connect, unwrap_http_response, breaker_stats
+from xmlrcp import xmlrpc_utilities, wrap_http_request
+
+
+# Servidor con un unico hilo y lugar para una conexion en la cola. El
+# metodo 'ocupar' bloquea el hilo hasta que se libera 'release'.
+def pool_server(start_server):
+    server = Server(("localhost", 0))
+    server.pool_workers = 1
+    server.pool_queue_length = 1
+    started = threading.Event()
+    release = threading.Event()
+
+    def ocupar():
+        started.set()
+        release.wait(5)
+        return True
+
+    server.add_method(ocupar)
+    server.add_method(lambda a, b: a + b, name="suma")
+    port = start_server(server, "serve_pool")
+    return server, port, started, release
+
+
+def request(method, params):
+    body = xmlrpc_utilities.write_xmlrpc_request(params, method)
+    return wrap_http_request(body, "pytest")
+
+
+def test_pool_rejects_when_queue_full(start_server):
+    server, port, started, release = pool_server(start_server)
+    codes = []
+
+    # Una conexion ocupa el hilo y otra queda en la cola.
+    data = request("ocupar", [])
+    busy = [
+        threading.Thread(target=lambda: codes.append(raw_request(port, data)))
+        for _ in range(2)
+    ]
+    busy[0].start()
+    assert started.wait(5)
+    busy[1].start()
+    while server.pool_stats()["queue_depth"] < 1:
+        started.wait(0.01)
+
+    # El rechazo se envia al aceptar la conexion, sin leer el request.
+    code, response = raw_request(port, b"")
+    assert code == 503
+    assert xmlrpc_utilities.read_xmlrpc_response(
+        unwrap_http_response(response)
+    )["faultCode"] == 5
+
+    release.set()
+    for th in busy:
+        th.join()
+    assert [code for code, _ in codes] == [200, 200]
+    stats = server.pool_stats()
+    assert stats["accepted"] == 2 and stats["rejected"] == 1
+
+
+def test_client_retries_rejected_call(start_server):
+    server, port, started, release = pool_server(start_server)
+    busy = [
+        threading.Thread(target=connect("localhost", port).ocupar)
+        for _ in range(2)
+    ]
+    busy[0].start()
+    assert started.wait(5)
+    busy[1].start()
+    while server.pool_stats()["queue_depth"] < 1:
+        started.wait(0.01)
+
+    # La llamada se rechaza con 503 y se reintenta hasta que hay lugar.
+    client = connect("localhost", port)
+    client.keep_alive = False
+    client.retries = 4
+    client.backoff_base = 0.1
+    threading.Timer(0.1, release.set).start()
+    assert client.suma(1, 2) == 3
+    for th in busy:
+        th.join()
+    assert server.pool_stats()["rejected"] >= 1
+    assert breaker_stats()["localhost:%d" % port]["retries"] >= 1
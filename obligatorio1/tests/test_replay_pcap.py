@@ -0,0 +1,63 @@
+import os
+import sys
+import zlib
+import socket
+import threading
+
+from conftest import BASE_DIR
+from xmlrcp import socket_functions
+
+sys.path.insert(0, os.path.join(BASE_DIR, "benchmarks"))
+import replay_pcap  # noqa: E402
+
+CAPTURE = os.path.join(
+    os.path.dirname(BASE_DIR),
+    "obligatorio2", "parte2", "prueba", "xml_rpc",
+    "prueba_cliente_http_parte_2_lado_client.pcap"
+)
+
+RESPONSE_BODY = (
+    b"<?xml version='1.0'?><methodResponse><params><param><value>"
+    b"<int>3</int></value></param></params></methodResponse>"
+)
+
+
+def gzip_response(body):
+    compressor = zlib.compressobj(wbits=31)
+    body = compressor.compress(body) + compressor.flush()
+    return (
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/xml\r\n"
+        b"Content-Encoding: gzip\r\nContent-Length: %d\r\n\r\n" % len(body)
+    ) + body
+
+
+def test_capture_calls():
+    calls = replay_pcap.read_calls(CAPTURE)
+    assert len(calls) == 14
+    assert all(call["response"] is not None for call in calls)
+    assert replay_pcap.method_name(calls[0]["data"]) == "suma"
+    servers = replay_pcap.read_calls(CAPTURE, 8080, "150.150.0.2")
+    assert len(servers) == 8
+
+
+def test_corrupt_compressed_response_is_a_difference():
+    valid = gzip_response(RESPONSE_BODY)
+    code, value = replay_pcap.response_value(valid)
+    assert code == [b"200"] and value["data"] == 3
+
+    corrupt = valid[:-12] + b"\x00" * 12
+    code, value = replay_pcap.response_value(corrupt)
+    assert code == [b"200"]
+    assert "compresion invalida" in value
+
+
+def test_read_message_max_size():
+    server, client = socket.socketpair()
+    message = (
+        b"HTTP/1.1 200 OK\r\nContent-Length: 1000000000\r\n\r\n"
+    )
+    threading.Thread(target=server.sendall, args=(message, )).start()
+    readed = socket_functions.read_message(client, 65536, 1024 * 1024)
+    assert not readed["status"] and readed["too_large"]
+    server.close()
+    client.close()
@@ -0,0 +1,55 @@
+import time
+import socket
+import collections
+
+from xmlrcp import Server, connect_pool
+from xmlrcp.client import ReplicaClient
+
+
+def replica_server(start_server, slow):
+    server = Server(("localhost", 0))
+    port = server.sock.getsockname()[1]
+
+    def quien():
+        if slow.pop(port, None):
+            time.sleep(0.3)
+        return port
+
+    server.add_method(quien)
+    return start_server(server)
+
+
+def test_stale_latency_recovers(start_server, monkeypatch):
+    # La latencia se acerca al promedio con el tiempo; se acorta para que
+    # el resultado no dependa de la velocidad de la maquina.
+    monkeypatch.setattr(ReplicaClient, "DECAY_TIME", 0.05)
+    slow = {}
+    ports = [replica_server(start_server, slow) for _ in range(3)]
+    client = connect_pool([("localhost", port) for port in ports])
+    for _ in range(30):
+        client.quien()
+
+    # Despues de una llamada lenta aislada el servidor vuelve a recibir
+    # una parte de las llamadas.
+    slow[ports[0]] = True
+    while slow:
+        client.quien()
+    counts = collections.Counter(client.quien() for _ in range(1500))
+    assert counts[ports[0]] > 100
+
+
+def test_dead_replica_leaves_rotation(start_server):
+    ports = [replica_server(start_server, {}) for _ in range(2)]
+    tmp = socket.socket()
+    tmp.bind(("localhost", 0))
+    dead = tmp.getsockname()[1]
+    tmp.close()
+
+    client = connect_pool([("localhost", port) for port in ports + [dead]])
+    client.idempotent = ("quien", )
+    counts = collections.Counter(client.quien() for _ in range(200))
+    assert sum(counts.values()) == 200
+    assert counts[dead] == 0
+    replica = client.replicas[2]
+    others = client.replicas[:2]
+    assert replica.latency > max(other.latency for other in others)
@@ -0,0 +1,104 @@
+import time
+import socket
+import asyncio
+
+import pytest
+
+from conftest import MODES
+from xmlrcp import Server, connect, connect_async, gather_calls
+from xmlrcp import CircuitOpenError, breaker_stats
+from xmlrcp.breaker import CircuitBreaker
+
+
+def free_port():
+    tmp = socket.socket()
+    tmp.bind(("localhost", 0))
+    port = tmp.getsockname()[1]
+    tmp.close()
+    return port
+
+
+# Servidor con un metodo 'lento' que cuenta sus ejecuciones en 'runs'.
+def slow_server(runs, port=0):
+    server = Server(("localhost", port))
+
+    def lento(seconds):
+        runs.append(seconds)
+        time.sleep(seconds)
+        return seconds
+
+    server.add_method(lento)
+    server.add_method(lambda a, b: a + b, name="suma")
+    return server
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_deadline(start_server, mode):
+    runs = []
+    client = connect("localhost", start_server(slow_server(runs), mode))
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        client.call("lento", [0.6], timeout=0.2)
+    assert time.monotonic() - start < 0.5
+
+    # La llamada no es idempotente, por lo que no se reintenta.
+    time.sleep(0.6)
+    assert runs == [0.6]
+    assert client.suma(1, 2) == 3
+
+
+def test_circuit_breaker(start_server, monkeypatch):
+    monkeypatch.setattr(CircuitBreaker, "RESET_TIME", 0.2)
+    port = free_port()
+    client = connect("localhost", port)
+    client.retries = 0
+    for _ in range(CircuitBreaker.failure_threshold):
+        with pytest.raises(ConnectionRefusedError):
+            client.suma(1, 2)
+
+    # Con el circuito abierto las llamadas fallan sin conectarse.
+    with pytest.raises(CircuitOpenError):
+        client.suma(1, 2)
+    stats = breaker_stats()["localhost:%d" % port]
+    assert stats["state"] == "open" and stats["short_circuited"] == 1
+
+    # Pasado RESET_TIME la llamada de prueba cierra el circuito.
+    start_server(slow_server([], port))
+    time.sleep(0.2)
+    assert client.suma(1, 2) == 3
+    assert breaker_stats()["localhost:%d" % port]["state"] == "closed"
+
+
+def test_async_deadline(start_server):
+    runs = []
+    port = start_server(slow_server(runs), "serve_pool")
+
+    async def main():
+        client = connect_async("localhost", port)
+        try:
+            with pytest.raises(TimeoutError):
+                await client.call("lento", [0.6], timeout=0.2)
+            await asyncio.sleep(0.6)
+            return await client.suma(1, 2)
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == 3
+    assert runs == [0.6]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_async_fan_out(start_server, mode):
+    port = start_server(slow_server([]), mode)
+
+    async def main():
+        client = connect_async("localhost", port)
+        try:
+            return await gather_calls(
+                [client.suma(i, i) for i in range(40)],
+                timeout=5
+            )
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == [i * 2 for i in range(40)]
@@ -1,5 +1,9 @@
 from .server import Server
-from .client import connect, XmlRpcException
+from .cache import ResultCache
+from .client import connect, XmlRpcException, MultiCall
+from .client import CircuitOpenError, Pipeline
+from .breaker import breaker_stats
+from .client import connect_async, gather_calls, connect_pool
 from .xmlrpc_utilities import read_xmlrpc_response
 from .http_utilities import unwrap_http_response
 from .http_utilities import wrap_http_request
@@ -0,0 +1,370 @@
+import struct
+from datetime import datetime
+from .xmlrpc_utilities import FAULT_STRINGS, CHUNK_SIZE, is_file, spool_file
+
+# Codificacion binaria de los mensajes, para usar entre clientes y
+# servidores xmlrcp. Representa los mismos valores que XMLRPC: cada valor
+# es una etiqueta de un byte seguida de su contenido, los largos y
+# cantidades son enteros de 32 bits sin signo, y los numeros se escriben
+# en big endian.
+
+# Etiquetas de cada tipo de valor.
+INT = b"i"          # entero de 32 bits.
+LONG = b"l"         # entero de 64 bits.
+BIG = b"n"          # entero mas grande, como texto decimal.
+TRUE = b"t"
+FALSE = b"f"
+DOUBLE = b"d"
+STRING = b"s"
+DATETIME = b"D"     # texto en formato ISO 8601.
+BASE64 = b"b"
+ARRAY = b"a"
+STRUCT = b"S"
+
+# Inicio de cada tipo de mensaje.
+CALL = b"C"
+RESPONSE = b"R"
+FAULT = b"F"
+
+SIZE = struct.Struct(">I")
+TAGGED_SIZE = struct.Struct(">cI")
+TAGGED_INT = struct.Struct(">ci")
+TAGGED_LONG = struct.Struct(">cq")
+TAGGED_DOUBLE = struct.Struct(">cd")
+
+# Cada byte como bytes de largo 1, para leer las etiquetas de un bytearray
+# y compararlas como bytes.
+BYTE_TAGS = [bytes([value]) for value in range(256)]
+
+
+# -------------------
+# |     Escritura   |
+# |       de        |
+# |     Mensajes    |
+# -------------------
+
+
+# Marca para diferenciar los nombres de los members de los strings dentro
+# de la pila de iter_value.
+class Name(str):
+    pass
+
+
+# Generador que retorna de a 'chunk_size' bytes los 'size' bytes de un
+# archivo desde su posicion actual, y vuelve a ella al terminar, igual
+# que xmlrpc_utilities.iter_base64. Si el archivo tiene menos bytes que
+# los indicados el mensaje quedaria mal formado, y se levanta Exception.
+def iter_file(info, size, chunk_size=CHUNK_SIZE):
+    start = info.tell()
+    try:
+        while size:
+            data = info.read(min(size, chunk_size))
+            if not data:
+                raise Exception()
+            size -= len(data)
+            yield data
+    finally:
+        info.seek(start)
+
+
+# Retorna la cantidad de bytes de un archivo desde su posicion actual.
+def file_size(info):
+    start = info.tell()
+    end = info.seek(0, 2)
+    info.seek(start)
+    return end - start
+
+
+# Generador que retorna por partes la codificacion de un valor, que se
+# agrega a continuacion de lo que ya tiene 'out' (un bytearray). Los
+# archivos se leen de a CHUNK_SIZE bytes, sin tenerlos completos en
+# memoria, salvo que no permitan seek y no se sepa su largo. Los structs y
+# arrays se recorren con una pila en lugar de recursion.
+def iter_value(info, out):
+    stack = [info]
+    while stack:
+        info = stack.pop()
+        kind = type(info)
+        if kind is str or kind is Name:
+            data = info.encode()
+            if kind is str:
+                out += TAGGED_SIZE.pack(STRING, len(data))
+            else:
+                out += SIZE.pack(len(data))
+            out += data
+        elif kind is int:
+            if -0x80000000 <= info <= 0x7fffffff:
+                out += TAGGED_INT.pack(INT, info)
+            elif -0x8000000000000000 <= info <= 0x7fffffffffffffff:
+                out += TAGGED_LONG.pack(LONG, info)
+            else:
+                data = str(info).encode()
+                out += TAGGED_SIZE.pack(BIG, len(data))
+                out += data
+        elif kind is bool:
+            out += TRUE if info else FALSE
+        elif kind is float:
+            out += TAGGED_DOUBLE.pack(DOUBLE, info)
+        elif kind is list or kind is tuple:
+            out += TAGGED_SIZE.pack(ARRAY, len(info))
+            stack.extend(reversed(info))
+        elif kind is dict:
+            out += TAGGED_SIZE.pack(STRUCT, len(info))
+            for key in reversed(info):
+                stack.append(info[key])
+                stack.append(Name(key))
+        elif kind is datetime:
+            data = info.isoformat().encode()
+            out += TAGGED_SIZE.pack(DATETIME, len(data))
+            out += data
+        elif kind is bytes:
+            out += TAGGED_SIZE.pack(BASE64, len(info))
+            out += info
+        elif is_file(info) and info.seekable():
+            size = file_size(info)
+            out += TAGGED_SIZE.pack(BASE64, size)
+            yield out
+            out = bytearray()
+            yield from iter_file(info, size)
+        elif is_file(info):
+            data = info.read()
+            out += TAGGED_SIZE.pack(BASE64, len(data))
+            out += data
+        else:
+            raise Exception()
+    yield out
+
+
+# Agrega a 'out' la codificacion de un valor.
+def write_value(info, out):
+    for part in iter_value(info, out):
+        if part is not out:
+            out += part
+
+
+# Generador que retorna por partes el mensaje binario que representa una
+# consulta de una operacion, con la misma forma que iter_xmlrpc_request.
+def iter_binary_request(params, method):
+    out = bytearray(CALL)
+    method = method.encode()
+    out += SIZE.pack(len(method))
+    out += method
+    yield from iter_value(list(params), out)
+
+
+# funcion que retorna el mensaje binario que representa una consulta de
+# una operacion.
+def write_binary_request(params, method):
+    return b"".join(iter_binary_request(params, method))
+
+
+# Generador con el mensaje binario con el resultado de una operacion, con
+# la misma forma que iter_xmlrpc_response.
+def iter_binary_response(result):
+    yield from iter_value(result, bytearray(RESPONSE))
+
+
+def write_binary_response(result):
+    return b"".join(iter_binary_response(result))
+
+
+# funcion que retorna un mensaje binario de error con el codigo y mensaje
+# de error correspondiente. Los de los codigos conocidos se arman una
+# unica vez, en FAULT_BODIES.
+def write_binary_error(code):
+    body = FAULT_BODIES.get(code)
+    if body is None:
+        body = build_binary_error(code)
+    return body
+
+
+def build_binary_error(code):
+    out = bytearray(FAULT)
+    write_value({
+        "faultCode": code,
+        "faultString": FAULT_STRINGS.get(code)
+    }, out)
+    return bytes(out)
+
+
+FAULT_BODIES = {code: build_binary_error(code) for code in FAULT_STRINGS}
+
+
+# -------------------
+# |     Lectura     |
+# |       de        |
+# |     Mensajes    |
+# -------------------
+
+
+# Lee los bytes de un valor base64 de 'data' en 'pos' (su largo y
+# contenido) y retorna una vista de los bytes, sin copiarlos, y la
+# posicion siguiente.
+def read_bytes(data, pos):
+    size = SIZE.unpack_from(data, pos)[0]
+    pos += 4
+    end = pos + size
+    if end > len(data):
+        raise Exception()
+    return memoryview(data)[pos:end], end
+
+
+# Lee un string de 'data' en 'pos' (su largo y contenido) y retorna el
+# string y la posicion siguiente.
+def read_string(data, pos):
+    size = SIZE.unpack_from(data, pos)[0]
+    pos += 4
+    end = pos + size
+    if end > len(data):
+        raise Exception()
+    return data[pos:end].decode(), end
+
+
+# Lee un valor de 'data' en 'pos' y retorna el valor y la posicion
+# siguiente. Los structs y arrays que se estan leyendo se guardan en una
+# pila junto a la cantidad de elementos que les faltan y, para los que
+# estan dentro de un struct, su nombre. Si se indica 'spool', los valores
+# base64 se retornan como el archivo que crea a partir de sus bytes, que
+# se escriben directamente desde 'data'.
+def read_value(data, pos, spool=None):
+    stack = []
+    while True:
+        key = None
+        if stack and type(stack[-1][0]) is dict:
+            key, pos = read_string(data, pos)
+
+        tag = BYTE_TAGS[data[pos]]
+        pos += 1
+        if tag == ARRAY or tag == STRUCT:
+            count = SIZE.unpack_from(data, pos)[0]
+            pos += 4
+            value = [] if tag == ARRAY else {}
+            if count:
+                stack.append([value, count, key])
+                continue
+        elif tag == INT:
+            value = TAGGED_INT.unpack_from(data, pos - 1)[1]
+            pos += 4
+        elif tag == LONG:
+            value = TAGGED_LONG.unpack_from(data, pos - 1)[1]
+            pos += 8
+        elif tag == DOUBLE:
+            value = TAGGED_DOUBLE.unpack_from(data, pos - 1)[1]
+            pos += 8
+        elif tag == TRUE:
+            value = True
+        elif tag == FALSE:
+            value = False
+        elif tag == STRING:
+            value, pos = read_string(data, pos)
+        elif tag == BIG:
+            value, pos = read_string(data, pos)
+            value = int(value)
+        elif tag == DATETIME:
+            value, pos = read_string(data, pos)
+            value = datetime.fromisoformat(value)
+        elif tag == BASE64:
+            value, pos = read_bytes(data, pos)
+            if spool is not None:
+                value = spool(value)
+            else:
+                value = bytes(value)
+        else:
+            raise Exception()
+
+        # Se agrega el valor a su contenedor, cerrando los que se completan.
+        while stack:
+            frame = stack[-1]
+            container = frame[0]
+            if type(container) is dict:
+                container[key] = value
+            else:
+                container.append(value)
+            frame[1] -= 1
+            if frame[1]:
+                break
+            stack.pop()
+            value = container
+            key = frame[2]
+        else:
+            return value, pos
+
+
+# Decodificador de mensajes binarios, con la misma interfaz que
+# XmlRpcParser. El mensaje se acumula con 'feed' y se decodifica en
+# 'close', que retorna el resultado en el mismo formato que
+# read_xmlrpc_request o read_xmlrpc_response, segun 'root'. Con 'files'
+# los valores base64 se retornan como archivos, igual que en XmlRpcParser.
+# El mensaje se decodifica desde el mismo buffer en el que se acumula,
+# para no tener varias copias de los valores base64 grandes.
+class BinaryParser(object):
+    def __init__(self, root, files=None):
+        self.root = root
+        self.files = files
+        self.data = bytearray()
+        self.opened = []
+
+    def feed(self, data):
+        self.data += data
+
+    # Crea el archivo temporal de un valor base64. Se escribe de a partes
+    # para que pase al disco al superar SPOOL_SIZE, sin copiar el valor
+    # completo en memoria.
+    def spool(self, data):
+        file = spool_file()
+        self.opened.append(file)
+        for start in range(0, len(data), CHUNK_SIZE):
+            file.write(data[start:start + CHUNK_SIZE])
+        file.seek(0)
+        return file
+
+    # Retorna la funcion que crea los archivos de los valores base64 de
+    # los mensajes de 'method', o None si se retornan como bytes.
+    def spool_for(self, method):
+        if self.files is not None and self.files(method):
+            return self.spool
+        return None
+
+    def close(self):
+        data = self.data
+        self.data = bytearray()
+        if self.root == "methodCall":
+            if data[:1] != CALL:
+                raise Exception()
+            method, pos = read_string(data, 1)
+            params, pos = read_value(data, pos, self.spool_for(method))
+            if type(params) is not list:
+                raise Exception()
+            ret = {"method": method, "params": params}
+        else:
+            tag = data[:1]
+            if tag != RESPONSE and tag != FAULT:
+                raise Exception()
+            value, pos = read_value(data, 1, self.spool_for(None))
+            if tag == RESPONSE:
+                ret = {"type": False, "data": value}
+            else:
+                if type(value) is not dict or len(value) != 2:
+                    raise Exception()
+                if type(value.get("faultCode")) is not int:
+                    raise Exception()
+                if type(value.get("faultString")) is not str:
+                    raise Exception()
+                ret = value
+                ret["type"] = True
+
+        if pos != len(data):
+            raise Exception()
+        return ret
+
+
+def read_binary_response(data):
+    parser = BinaryParser("methodResponse")
+    parser.feed(data)
+    return parser.close()
+
+
+def read_binary_request(data):
+    parser = BinaryParser("methodCall")
+    parser.feed(data)
+    return parser.close()
@@ -0,0 +1,108 @@
+import time
+from threading import Lock
+
+
+class CircuitBreaker(object):
+    # Circuit breaker de un servidor. Despues de failure_threshold fallos
+    # seguidos el circuito se abre y las llamadas fallan inmediatamente,
+    # sin conectarse, hasta que pasa RESET_TIME; entonces se deja pasar
+    # una llamada de prueba que lo vuelve a cerrar o abrir.
+
+    # Cantidad de fallos seguidos que abren el circuito.
+    failure_threshold = 5
+
+    # Tiempo en segundos que el circuito permanece abierto antes de dejar
+    # pasar una llamada de prueba.
+    RESET_TIME = 5
+
+    def __init__(self):
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0
+        self.lock = Lock()
+
+        # Contadores de llamadas correctas, fallos, reintentos, llamadas
+        # rechazadas con el circuito abierto y veces que se abrio.
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.short_circuited = 0
+        self.opened = 0
+
+    # Indica si se puede hacer una llamada. Con el circuito abierto pasa a
+    # semiabierto despues de RESET_TIME y deja pasar una llamada de prueba;
+    # si esta no termina en RESET_TIME se deja pasar otra.
+    def allow(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if now - self.opened_at >= self.RESET_TIME:
+                self.state = "half-open"
+                self.opened_at = now
+                return True
+            self.short_circuited += 1
+            return False
+
+    # Indica si el circuito abierto ya puede dejar pasar una llamada de
+    # prueba, sin contarla como llamada.
+    def probe_due(self):
+        return (
+            self.state != "closed" and
+            time.monotonic() - self.opened_at >= self.RESET_TIME
+        )
+
+    def success(self):
+        with self.lock:
+            self.successes += 1
+            self.consecutive = 0
+            self.state = "closed"
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.consecutive += 1
+            if self.state == "half-open" or (
+                self.state == "closed" and
+                self.consecutive >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+    def retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "short_circuited": self.short_circuited,
+            "opened": self.opened
+        }
+
+
+# Circuit breakers de cada servidor, compartidos por todos los clientes.
+breakers = {}
+breakers_lock = Lock()
+
+
+def get_breaker(address, port):
+    with breakers_lock:
+        breaker = breakers.get((address, port))
+        if breaker is None:
+            breaker = breakers[(address, port)] = CircuitBreaker()
+        return breaker
+
+
+# Retorna los contadores y el estado del circuit breaker de cada servidor,
+# por "direccion:puerto".
+def breaker_stats():
+    with breakers_lock:
+        return {
+            "%s:%s" % key: breaker.stats()
+            for key, breaker in breakers.items()
+        }
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+# Retorna una clave hashable que representa a 'value', un valor decodificado
+# de XMLRPC. Incluye el tipo de cada valor, para que 1, 1.0 y True no
+# compartan la misma entrada.
+def cache_key(value):
+    kind = type(value)
+    if kind is list or kind is tuple:
+        return (list, tuple(cache_key(item) for item in value))
+    if kind is dict:
+        return (dict, tuple(sorted(
+            (key, cache_key(item)) for key, item in value.items()
+        )))
+    return (kind, value)
+
+
+class ResultCache(object):
+    # Cache LRU de responses ya codificados de un metodo, indexada por sus
+    # parametros. Las entradas vencen a los 'ttl' segundos si se indica.
+
+    def __init__(self, max_size=128, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        # Contadores de aciertos y fallos.
+        self.hits = 0
+        self.misses = 0
+
+    # Retorna el response guardado para 'key', o None si no esta o vencio.
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                data, expires = entry
+                if expires is None or time.monotonic() < expires:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    # Guarda el response 'data' para 'key', descartando la entrada usada
+    # hace mas tiempo si la cache esta llena.
+    def put(self, key, data):
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (data, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
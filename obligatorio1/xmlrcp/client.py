@@ -1,10 +1,19 @@
+import asyncio
 import socket
+import select
+import random
+import time
+from threading import Lock, Thread
 from . import http_utilities
 from . import xmlrpc_utilities
+from . import binary_utilities
 from . import socket_functions
+from .breaker import get_breaker
 
 FORMAT_ERROR = "La respuesta no es un XMLRPC response."
 CONNECTION_ERROR = "Hubo un problema en la conexion con el servidor."
+TIMEOUT_ERROR = "Se termino el tiempo de la llamada."
+CIRCUIT_ERROR = "El servidor no esta disponible (circuito abierto)."
 
 
 class XmlRpcException(Exception):
@@ -14,6 +23,120 @@ class XmlRpcException(Exception):
         super().__init__("")
 
 
+# Error de las llamadas que se rechazan sin conectarse porque el circuit
+# breaker del servidor esta abierto.
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+# Error de las conexiones reutilizadas que el servidor cerro sin responder
+# (por ejemplo por estar inactivas). El servidor no llego a procesar el
+# request, por lo que se puede reenviar por una nueva conexion.
+class StaleConnectionError(ConnectionError):
+    pass
+
+
+# Error de las conexiones que no se llegaron a establecer a tiempo. El
+# request no se llego a enviar, por lo que se puede reintentar.
+class ConnectTimeoutError(TimeoutError):
+    pass
+
+
+# Indica si 'error' es un fallo del servidor para el circuit breaker: un
+# error de conexion o timeout, un response mal formado, o el fault 5 con
+# el que el servidor rechaza requests cuando esta saturado. Los demas
+# faults son respuestas normales del servidor.
+def is_failure(error):
+    if isinstance(error, XmlRpcException):
+        return error.code == 5
+    return isinstance(error, (OSError, SyntaxError))
+
+
+class ConnectionPool(object):
+    # Tiempo en segundos que una conexion puede estar inactiva en el pool.
+    IDLE_TIME = 4
+
+    # Cantidad maxima de conexiones inactivas por servidor.
+    max_idle = 4
+
+    def __init__(self):
+        self.idle = {}
+        self.lock = Lock()
+
+    # Comprueba que el servidor no haya cerrado la conexion. Una conexion
+    # sana e inactiva no tiene nada para leer.
+    def is_healthy(self, sock):
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    # Retorna una conexion inactiva hacia (address, port), descartando las
+    # vencidas o cerradas, o None si no hay ninguna.
+    def get(self, address, port):
+        now = time.monotonic()
+        with self.lock:
+            conns = self.idle.get((address, port), [])
+            while conns:
+                sock, last_used = conns.pop()
+                if now - last_used < self.IDLE_TIME and self.is_healthy(sock):
+                    return sock
+                sock.close()
+        return None
+
+    # Devuelve una conexion al pool para ser reutilizada.
+    def put(self, address, port, sock):
+        with self.lock:
+            conns = self.idle.setdefault((address, port), [])
+            if len(conns) >= self.max_idle:
+                sock.close()
+                return
+            conns.append((sock, time.monotonic()))
+
+    def clear(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for sock, _ in conns:
+                    sock.close()
+            self.idle = {}
+
+
+# Pool compartido por todos los clientes.
+pool = ConnectionPool()
+
+
+# Crea los decodificadores del cuerpo de un response con los headers
+# 'head': el decodificador XMLRPC en 'parser', el descompresor si el cuerpo
+# esta comprimido en 'decoder', y la funcion a la que pasarle el cuerpo en
+# 'feed'. Con 'files' los valores base64 se retornan como archivos.
+def response_decoder(head, files=False):
+    files = (lambda name: True) if files else None
+    if head["content_type"] == http_utilities.BINARY_CONTENT_TYPE:
+        parser = binary_utilities.BinaryParser("methodResponse", files)
+    else:
+        parser = xmlrpc_utilities.XmlRpcParser("methodResponse", files)
+    if head["encoding"] is None:
+        return {"parser": parser, "decoder": None, "feed": parser.feed}
+    decoder = http_utilities.Decompressor(head["encoding"], parser.feed)
+    return {"parser": parser, "decoder": decoder, "feed": decoder.feed}
+
+
+# Retorna el resultado de un response ya decodificado con 'decoded' (ver
+# response_decoder), o levanta la excepcion del fault que contiene.
+def read_result(decoded):
+    try:
+        if decoded["decoder"] is not None:
+            decoded["decoder"].close()
+        data = decoded["parser"].close()
+    except Exception:
+        raise SyntaxError(FORMAT_ERROR)
+
+    if data["type"]:
+        raise XmlRpcException(int(data["faultCode"]), data["faultString"])
+    return data["data"]
+
+
 class Client(object):
     # User agent del cliente.
     user_agent = "Agente"
@@ -29,69 +152,917 @@ class Client(object):
     REGULAR_TIME = 0.5
     OPERATIONAL_TIME = 2.5
 
+    # Indica si se reutilizan las conexiones con el servidor.
+    keep_alive = True
+
+    # Codificaciones que se aceptan para el response, por ejemplo
+    # "gzip, deflate", y largo minimo del cuerpo de un request para
+    # comprimirlo con gzip. Por defecto no se usan, ya que los servidores
+    # anteriores rechazan los headers que no conocen.
+    accept_encoding = None
+    compress_min_size = None
+
+    # Indica si los mensajes se codifican con binary_utilities en lugar de
+    # XML. Solo lo entienden los servidores xmlrcp; si el servidor responde
+    # 415 el cliente vuelve a usar XML.
+    binary = False
+
+    # Indica si los valores base64 de los resultados se retornan como
+    # archivos temporales (SpooledTemporaryFile) en lugar de bytes, para
+    # no tener en memoria los resultados grandes. Los parametros pueden
+    # ser archivos abiertos en modo binario, que se envian con su
+    # contenido sin cambiar su posicion.
+    files = False
+
+    # Tiempo maximo en segundos de cada llamada, incluidos sus reintentos.
+    # Con None cada etapa solo esta limitada por REGULAR_TIME u
+    # OPERATIONAL_TIME. Se puede cambiar en cada llamada con 'timeout'.
+    timeout = None
+
+    # Cantidad maxima de reintentos de una llamada que falla, y tiempos
+    # en segundos de la espera entre ellos, que se duplica en cada
+    # reintento y se elige al azar entre 0 y ese valor.
+    retries = 2
+    backoff_base = 0.05
+    backoff_max = 1
+
+    # Nombres de los metodos que se pueden ejecutar mas de una vez sin
+    # efectos no deseados, y que por lo tanto se reintentan ante cualquier
+    # fallo. Los demas solo se reintentan si el servidor no llego a
+    # recibirlos.
+    idempotent = ()
+
+    # Indica si las llamadas fallan inmediatamente mientras el circuit
+    # breaker del servidor esta abierto.
+    circuit_breaker = True
+
     def __init__(self, address, port):
         self.address = address
         self.port = port
 
+    # Retorna 'limit' acotado al tiempo que le queda a la llamada hasta
+    # 'deadline', o levanta TimeoutError si ya no le queda.
+    def time_left(self, limit, deadline):
+        if deadline is None:
+            return limit
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise TimeoutError(TIMEOUT_ERROR)
+        return min(limit, left)
+
+    # Retorna la espera en segundos antes de reintentar por 'attempt'-esima
+    # vez una llamada a 'method' que fallo con 'error', o None si no se
+    # reintenta. Las conexiones rechazadas o que no se establecieron a
+    # tiempo y los rechazos por saturacion (fault 5) o por circuito
+    # abierto se reintentan en cualquier metodo,
+    # ya que el servidor no lo llego a ejecutar. Las conexiones
+    # reutilizadas que el servidor cerro sin responder se reenvian
+    # enseguida, sin contar como reintento (ver handle_failure).
+    def retry_delay(self, method, error, attempt, deadline):
+        if isinstance(error, StaleConnectionError):
+            return 0
+        if attempt >= self.retries:
+            return None
+        if method not in self.idempotent and not isinstance(
+            error,
+            (XmlRpcException, ConnectionRefusedError, CircuitOpenError,
+             ConnectTimeoutError)
+        ):
+            return None
+        delay = random.uniform(
+            0,
+            min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        )
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    # Retorna una conexion con el servidor, del pool si hay alguna, e
+    # indica si es reutilizada. La conexion tiene OPERATIONAL_TIME
+    # segundos para establecerse, ya que si la cola de conexiones del
+    # servidor esta llena el SYN se retransmite recien despues de un
+    # segundo.
+    def open_socket(self, deadline=None):
+        sock = None
+        if self.keep_alive:
+            sock = pool.get(self.address, self.port)
+
+        reused = sock is not None
+        if not reused:
+            # Creación del socket cliente.
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(self.time_left(self.OPERATIONAL_TIME, deadline))
+            try:
+                sock.connect((self.address, self.port))
+            except socket.timeout:
+                sock.close()
+                raise ConnectTimeoutError(TIMEOUT_ERROR)
+            except OSError:
+                sock.close()
+                raise
+        return sock, reused
+
+    # Envia un HTTP request y lee los headers del HTTP response. Una
+    # conexion reutilizada puede haber sido cerrada por el servidor; si el
+    # envio fallo o el servidor la cerro sin responder nada se levanta
+    # StaleConnectionError, para que 'call' decida si reenviarlo. Si se
+    # llega al timeout el servidor puede estar ejecutando el metodo, y se
+    # levanta TimeoutError.
+    def request(self, data, deadline=None):
+        sock, reused = self.open_socket(deadline)
+        sock.settimeout(self.time_left(self.REGULAR_TIME, deadline))
+
+        # Envio de datos.
+        sended = socket_functions.send_parts(sock, data)
+        if not sended["status"]:
+            sock.close()
+            if reused:
+                raise StaleConnectionError(CONNECTION_ERROR)
+            raise ConnectionError(CONNECTION_ERROR)
+
+        # recepcion de datos. Cada lectura se limita al tiempo que le
+        # queda a la llamada.
+        sock.settimeout(self.time_left(self.OPERATIONAL_TIME, deadline))
+        reader = socket_functions.MessageReader(
+            sock,
+            self.buffer_size,
+            deadline
+        )
+        head = reader.read_head()
+        if not head["status"] or not head["data"]:
+            sock.close()
+            if head["timeout"] or (
+                deadline is not None and time.monotonic() >= deadline
+            ):
+                raise TimeoutError(TIMEOUT_ERROR)
+            if reused and not head["data"]:
+                raise StaleConnectionError(CONNECTION_ERROR)
+            raise ConnectionError(CONNECTION_ERROR)
+
+        return {"sock": sock, "reader": reader, "data": head["data"]}
+
+    # Valida el destino y crea el HTTP request que invoca 'method', como
+    # una lista con los headers y las partes del cuerpo, que se envian sin
+    # juntarlas.
+    def write_call(self, method, params):
+
+        # Validación de parametros
+        if self.address is None:
+            raise TypeError("Direccion no encontrada.")
+
+        elif self.port is None:
+            raise TypeError("Puerto no encontrada.")
+
+        # Creacion de data.
+        if self.binary:
+            content_type = http_utilities.BINARY_CONTENT_TYPE
+            data = list(binary_utilities.iter_binary_request(params, method))
+        else:
+            content_type = http_utilities.XML_CONTENT_TYPE
+            data = list(
+                xmlrpc_utilities.iter_xmlrpc_request(tuple(params), method)
+            )
+        encoding = None
+        if self.compress_min_size is not None and sum(
+            len(part) for part in data
+        ) >= self.compress_min_size:
+            encoding = "gzip"
+            data = list(http_utilities.compress_chunks(data, encoding))
+        head = http_utilities.http_request_head(
+            sum(len(part) for part in data),
+            self.user_agent,
+            self.keep_alive,
+            encoding,
+            self.accept_encoding,
+            content_type
+        )
+        return [head] + data
+
+    # Indica si hay que repetir un request binario en XML, porque el
+    # servidor no acepta la codificacion binaria.
+    def binary_rejected(self, head):
+        if self.binary and head["code"] == 415:
+            self.binary = False
+            return True
+        return False
+
+    # Ejecuta 'method' en el servidor y retorna el resultado, terminando
+    # en 'timeout' segundos (por defecto self.timeout). Las llamadas que
+    # fallan se reintentan segun retry_delay, y mientras el circuit
+    # breaker del servidor este abierto se levanta CircuitOpenError sin
+    # conectarse.
+    def call(self, method, params, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        breaker = get_breaker(self.address, self.port)
+        attempt = 0
+        while True:
+            if self.circuit_breaker and not breaker.allow():
+                raise CircuitOpenError(CIRCUIT_ERROR)
+            try:
+                ret = self.call_once(method, params, deadline)
+            except Exception as ex:
+                delay = self.handle_failure(method, ex, attempt, deadline,
+                                            breaker)
+                if delay is None:
+                    raise
+                if not isinstance(ex, StaleConnectionError):
+                    attempt += 1
+                time.sleep(delay)
+                continue
+            breaker.success()
+            return ret
+
+    # Registra en 'breaker' el error 'error' de una llamada a 'method' y
+    # retorna la espera antes de reintentarla, o None si no se reintenta.
+    # Las conexiones reutilizadas que el servidor cerro sin responder no
+    # cuentan como fallo ni como reintento.
+    def handle_failure(self, method, error, attempt, deadline, breaker):
+        if not is_failure(error):
+            if isinstance(error, XmlRpcException):
+                breaker.success()
+            return None
+        stale = isinstance(error, StaleConnectionError)
+        if not stale:
+            breaker.failure()
+        delay = self.retry_delay(method, error, attempt, deadline)
+        if delay is not None and not stale:
+            breaker.retry()
+        return delay
+
+    # Realiza un unico intento de la llamada. El cuerpo del response se
+    # decodifica a medida que llega.
+    def call_once(self, method, params, deadline=None):
+
+        data = self.write_call(method, params)
+        try:
+            readed = self.request(data, deadline)
+        except (ConnectionRefusedError, StaleConnectionError) as ex:
+            raise type(ex)(CONNECTION_ERROR)
+        except ConnectionError:
+            raise ConnectionError(CONNECTION_ERROR)
+        sock = readed["sock"]
+        reader = readed["reader"]
+
+        # retorno de información.
+        try:
+            head = http_utilities.read_response_head(readed["data"])
+        except Exception:
+            sock.close()
+            raise SyntaxError(FORMAT_ERROR)
+        if self.binary_rejected(head):
+            sock.close()
+            return self.call_once(method, params, deadline)
+        decoded = response_decoder(head, self.files)
+        try:
+            sock.settimeout(self.time_left(self.OPERATIONAL_TIME, deadline))
+        except TimeoutError:
+            sock.close()
+            raise
+        body = reader.read_body(head["length"], decoded["feed"])
+        if not body["status"] or body["size"] != head["length"]:
+            sock.close()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(TIMEOUT_ERROR)
+            raise SyntaxError(FORMAT_ERROR)
+
+        # La conexion vuelve al pool si el servidor la mantiene.
+        if self.keep_alive and not reader.pending and http_utilities.is_keep_alive(
+            head["version"],
+            head["headers"]
+        ):
+            pool.put(self.address, self.port, sock)
+        else:
+            # cierre de socket cliente.
+            sock.close()
+
+        return read_result(decoded)
+
     def __getattr__(self, method):
         if method == "":
             raise AttributeError("No hay nombre para el metodo.")
 
         def ret(*args):
+            return self.call(method, args)
 
-            # Validación de parametros
-            if self.address is None:
-                raise TypeError("Direccion no encontrada.")
+        return ret
 
-            elif self.port is None:
-                raise TypeError("Puerto no encontrada.")
 
-            # Creacion de data.
-            data = xmlrpc_utilities.write_xmlrpc_request(tuple(args), method)
-            data = http_utilities.wrap_http_request(data, self.user_agent)
+class MultiCall(object):
+    # Agrupa llamadas a un servidor para enviarlas en un unico request con
+    # system.multicall. Las llamadas se encolan con la misma sintaxis que
+    # en Client, y al llamar al objeto se envian y se retorna una lista
+    # con los resultados en orden. Las llamadas que fallan tienen en su
+    # lugar la XmlRpcException correspondiente.
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
 
-            # Creación del socket cliente.
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def __getattr__(self, method):
+        if method == "":
+            raise AttributeError("No hay nombre para el metodo.")
 
-            try:
-                sock.connect((self.address, self.port))
-                sock.settimeout(self.REGULAR_TIME)
+        def ret(*args):
+            self.calls.append({"methodName": method, "params": list(args)})
+
+        return ret
+
+    def __call__(self):
+        if not self.calls:
+            return []
+        calls = self.calls
+        self.calls = []
+
+        data = self.client.call("system.multicall", [calls])
+
+        ret = []
+        for result in data:
+            if type(result) is dict:
+                ret.append(XmlRpcException(
+                    int(result["faultCode"]),
+                    result["faultString"]
+                ))
+            elif type(result) is list and len(result) == 1:
+                ret.append(result[0])
+            else:
+                raise SyntaxError(FORMAT_ERROR)
+        return ret
+
+
+class Pipeline(object):
+    # Envia varias llamadas por una misma conexion sin esperar el response
+    # de cada una (HTTP pipelining). Las llamadas se encolan con la misma
+    # sintaxis que en MultiCall, y al llamar al objeto se escriben todos
+    # los requests desde otro hilo mientras se leen los responses en
+    # orden. Se retorna la lista de resultados, con la XmlRpcException de
+    # las llamadas que fallan y un ConnectionError (o TimeoutError, si se
+    # termino el tiempo) en las que quedaron sin response. Solo los
+    # servidores xmlrcp separan requests seguidos en una misma conexion.
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, method):
+        if method == "":
+            raise AttributeError("No hay nombre para el metodo.")
+
+        def ret(*args):
+            self.calls.append((method, args))
+
+        return ret
+
+    def __call__(self):
+        calls = self.calls
+        self.calls = []
+        results = []
+        while len(results) < len(calls):
+            results += self.send(calls[len(results):])
+        return results
+
+    # Envia 'calls' por una conexion y retorna los resultados de las que
+    # se respondieron. Si el servidor cierra la conexion despues de un
+    # response (por ejemplo al llegar a su maximo de requests por
+    # conexion) no procesa los requests siguientes, por lo que se
+    # reenvian en otra conexion.
+    def send(self, calls, retry=True):
+        client = self.client
+        data = [client.write_call(method, params) for method, params in calls]
+        try:
+            sock, reused = client.open_socket()
+        except ConnectionError:
+            raise ConnectionError(CONNECTION_ERROR)
+        sock.settimeout(client.OPERATIONAL_TIME)
 
-                # Envio de datos.
-                sended = socket_functions.send_socket(sock, data)
+        # El servidor puede cerrar la conexion antes de recibir todos los
+        # requests (al llegar a su maximo por conexion); los que no se
+        # respondieron se reenvian, por lo que el error no se reporta.
+        def send_requests():
+            for parts in data:
+                sended = socket_functions.send_parts(sock, parts, False)
                 if not sended["status"]:
-                    sock.close()
                     return
 
-                # recepcion de datos.
-                sock.settimeout(self.OPERATIONAL_TIME)
-                readed = socket_functions.read_socket(sock, self.buffer_size)
-                if not readed["status"]:
-                    sock.close()
-                    return
-                data = readed["data"]
+        sender = Thread(target=send_requests, daemon=True)
+        sender.start()
 
-                # cierre de socket cliente.
+        reader = socket_functions.MessageReader(sock, client.buffer_size)
+        results = []
+        closed = False
+        completed = False
+        timed_out = False
+        try:
+            while len(results) < len(calls):
+                head = reader.read_head()
+                if not head["status"] or not head["data"]:
+                    timed_out = head["timeout"]
+                    break
+                try:
+                    head = http_utilities.read_response_head(head["data"])
+                except Exception:
+                    raise SyntaxError(FORMAT_ERROR)
+                if client.binary_rejected(head):
+                    closed = True
+                    break
+                decoded = response_decoder(head, client.files)
+                body = reader.read_body(head["length"], decoded["feed"])
+                if not body["status"] or body["size"] != head["length"]:
+                    raise SyntaxError(FORMAT_ERROR)
+                try:
+                    results.append(read_result(decoded))
+                except XmlRpcException as ex:
+                    results.append(ex)
+                if not http_utilities.is_keep_alive(
+                    head["version"],
+                    head["headers"]
+                ):
+                    closed = True
+                    break
+            completed = True
+        finally:
+            # Si no se leyeron todos los responses se corta la conexion,
+            # para que el hilo que envia no quede bloqueado.
+            if not completed or closed or len(results) < len(calls):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            sender.join()
+            if not completed:
                 sock.close()
-            except ConnectionError:
-                raise ConnectionError(CONNECTION_ERROR)
 
-            # retorno de información.
+        # La conexion vuelve al pool si el servidor la mantiene.
+        if not closed and len(results) == len(calls) and client.keep_alive \
+                and not reader.pending:
+            pool.put(client.address, client.port, sock)
+            return results
+        sock.close()
+
+        # Si una conexion reutilizada se cerro sin responder se reintenta
+        # una vez con otra. Si se termino el tiempo no se reintenta, ya que
+        # el servidor puede estar ejecutando las llamadas.
+        if len(results) < len(calls) and not closed:
+            if reused and retry and not results and not timed_out:
+                return self.send(calls, False)
+            error = TimeoutError if timed_out else ConnectionError
+            message = TIMEOUT_ERROR if timed_out else CONNECTION_ERROR
+            results += [
+                error(message) for _ in range(len(calls) - len(results))
+            ]
+        return results
+
+
+class AsyncClient(Client):
+    # Cliente para usar desde asyncio. Las llamadas se escriben igual que
+    # en Client pero retornan corrutinas, por lo que varias pueden estar
+    # en curso a la vez, cada una en su propia conexion. Las conexiones
+    # se reutilizan con keep-alive; como los streams de asyncio dependen
+    # del loop, el pool es propio de cada cliente y no el compartido.
+
+    # Cantidad maxima de llamadas en curso a la vez, cada una con su
+    # conexion. Las demas esperan a que termine alguna, para no llenar la
+    # cola de conexiones de los servidores con hilos.
+    max_connections = 8
+
+    def __init__(self, address, port):
+        super().__init__(address, port)
+        self.idle = []
+        self.slots = None
+
+    # Retorna una conexion inactiva al servidor o None si no hay.
+    def get_connection(self):
+        now = time.monotonic()
+        while self.idle:
+            reader, writer, last_used = self.idle.pop()
+            if (now - last_used < pool.IDLE_TIME and not reader.at_eof()
+                    and not writer.is_closing()):
+                return reader, writer
+            writer.close()
+        return None
+
+    def put_connection(self, reader, writer):
+        if len(self.idle) >= pool.max_idle:
+            writer.close()
+            return
+        self.idle.append((reader, writer, time.monotonic()))
+
+    # Envia un HTTP request y lee los headers del HTTP response. Al igual
+    # que en Client, si una conexion reutilizada se cerro sin responder se
+    # levanta StaleConnectionError. La conexion se establece dentro del
+    # tiempo de la llamada (ver call); en 'progress' se indica si el
+    # request se llego a enviar.
+    async def request(self, data, progress):
+        conn = self.get_connection() if self.keep_alive else None
+        reused = conn is not None
+        if not reused:
+            conn = await asyncio.open_connection(self.address, self.port)
+        reader, writer = conn
+
+        try:
+            progress["sent"] = True
+            writer.writelines(data)
+            await writer.drain()
+            head = await reader.readuntil(http_utilities.HEAD_END)
+        except (ConnectionError, asyncio.IncompleteReadError) as ex:
+            writer.close()
+            if reused and not (
+                isinstance(ex, asyncio.IncompleteReadError) and ex.partial
+            ):
+                raise StaleConnectionError(CONNECTION_ERROR)
+            raise ConnectionError(CONNECTION_ERROR)
+        except BaseException:
+            writer.close()
+            raise
+
+        return {"reader": reader, "writer": writer, "data": head}
+
+    async def read_call(self, method, params, progress):
+        data = self.write_call(method, params)
+        try:
+            readed = await self.request(data, progress)
+        except (ConnectionRefusedError, StaleConnectionError) as ex:
+            raise type(ex)(CONNECTION_ERROR)
+        except ConnectionError:
+            raise ConnectionError(CONNECTION_ERROR)
+        reader = readed["reader"]
+        writer = readed["writer"]
+
+        # Mientras no se lea el response completo la conexion no puede
+        # volver al pool, por lo que ante cualquier error o cancelacion
+        # se cierra.
+        done = False
+        try:
             try:
-                data = http_utilities.unwrap_http_response(data)
-                data = xmlrpc_utilities.read_xmlrpc_response(data)
+                head = http_utilities.read_response_head(readed["data"])
             except Exception:
                 raise SyntaxError(FORMAT_ERROR)
+            if self.binary_rejected(head):
+                writer.close()
+                return await self.read_call(method, params, progress)
 
-            if data["type"]:
-                raise XmlRpcException(int(data["faultCode"]), data["faultString"])
-            else:
-                data = data["data"]
+            decoded = response_decoder(head, self.files)
+            size = 0
+            while size < head["length"]:
+                rec = await reader.read(min(head["length"] - size, 65536))
+                if not rec:
+                    raise SyntaxError(FORMAT_ERROR)
+                decoded["feed"](rec)
+                size += len(rec)
+            done = True
+        finally:
+            if not done:
+                writer.close()
 
-            return data
+        # La conexion vuelve al pool si el servidor la mantiene.
+        if self.keep_alive and http_utilities.is_keep_alive(
+            head["version"],
+            head["headers"]
+        ):
+            self.put_connection(reader, writer)
+        else:
+            writer.close()
 
-        return ret
+        return read_result(decoded)
+
+    # Ejecuta 'method' en el servidor y retorna el resultado. Cada intento
+    # tiene OPERATIONAL_TIME segundos para terminar, incluida la conexion,
+    # y la llamada completa 'timeout' segundos (por defecto self.timeout);
+    # si no, se levanta asyncio.TimeoutError, o ConnectTimeoutError si no
+    # se llego a enviar el request. Los reintentos y el circuit breaker
+    # funcionan igual que en Client, y a lo sumo max_connections llamadas
+    # estan en curso a la vez.
+    async def call(self, method, params, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        breaker = get_breaker(self.address, self.port)
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        attempt = 0
+        while True:
+            if self.circuit_breaker and not breaker.allow():
+                raise CircuitOpenError(CIRCUIT_ERROR)
+            try:
+                async with self.slots:
+                    ret = await self.attempt_call(method, params, deadline)
+            except Exception as ex:
+                delay = self.handle_failure(method, ex, attempt, deadline,
+                                            breaker)
+                if delay is None:
+                    raise
+                if not isinstance(ex, StaleConnectionError):
+                    attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            breaker.success()
+            return ret
+
+    # Un intento de 'call'. Si se termina el tiempo antes de enviar el
+    # request (la conexion no se establecio) se levanta
+    # ConnectTimeoutError, que se puede reintentar.
+    async def attempt_call(self, method, params, deadline):
+        limit = self.time_left(self.OPERATIONAL_TIME, deadline)
+        progress = {"sent": False}
+        try:
+            return await asyncio.wait_for(
+                self.read_call(method, params, progress),
+                limit
+            )
+        except asyncio.TimeoutError:
+            if not progress["sent"]:
+                raise ConnectTimeoutError(TIMEOUT_ERROR)
+            raise
+
+    # Cierra las conexiones inactivas del cliente.
+    async def close(self):
+        while self.idle:
+            _, writer, _ = self.idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+# Espera a todas las llamadas (corrutinas) de 'calls' y retorna sus
+# resultados en orden. Con 'timeout' cada llamada tiene ese tiempo para
+# terminar. Con 'return_exceptions' los errores se retornan en lugar del
+# resultado; si no, el primer error cancela las llamadas restantes y se
+# levanta. Cancelar gather_calls tambien cancela todas las llamadas.
+async def gather_calls(calls, timeout=None, return_exceptions=False):
+    tasks = [
+        asyncio.ensure_future(asyncio.wait_for(call, timeout))
+        for call in calls
+    ]
+    if not tasks:
+        return []
+
+    try:
+        if return_exceptions:
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        # Se cancelan las llamadas en curso y se marcan como vistos los
+        # errores de las demas, que no se retornan.
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+class Replica(object):
+    # Uno de los servidores de un ReplicaClient, con el cliente que lo
+    # invoca, su circuit breaker, la cantidad de llamadas en curso y el
+    # promedio movil exponencial de su latencia, que es None mientras no
+    # tenga un valor inicial (ver ReplicaClient.refresh). En 'measured' se
+    # guarda cuando termino su ultima llamada.
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.client = Client(address, port)
+        self.breaker = get_breaker(address, port)
+        self.outstanding = 0
+        self.latency = None
+        self.measured = None
+        self.probing = False
+
+        # Indica si el servidor rechazo la codificacion binaria.
+        self.binary_rejected = False
+
+    # Costo estimado de enviarle una llamada mas.
+    def score(self):
+        return (self.outstanding + 1) * self.latency
+
+    def stats(self):
+        return {
+            "address": self.address,
+            "port": self.port,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "state": self.breaker.state
+        }
+
+
+class ReplicaClient(Client):
+    # Cliente de varios servidores equivalentes. Cada llamada se envia a
+    # uno de ellos segun 'balance', y si falla se reintenta en otro segun
+    # retry_delay. Los servidores con el circuit breaker abierto quedan
+    # fuera de rotacion hasta que una llamada de prueba a probe_method,
+    # hecha en otro hilo, muestra que volvieron a responder.
+
+    # Forma de elegir el servidor: "p2c" toma dos servidores al azar y
+    # elige el de menor latencia por llamadas en curso, y "least" el que
+    # tiene menos llamadas en curso.
+    balance = "p2c"
+
+    # Peso de cada nueva medicion en el promedio movil de la latencia, y
+    # latencia inicial en segundos cuando ningun servidor tiene mediciones.
+    # Los servidores sin mediciones (nuevos o que vuelven a rotacion)
+    # empiezan con el promedio de los demas.
+    EWMA_WEIGHT = 0.3
+    INITIAL_LATENCY = 0.01
+
+    # Las latencias estimadas se acercan al promedio de los servidores en
+    # rotacion, a la mitad cada DECAY_TIME segundos, y una fraccion
+    # EXPLORE_RATE de las llamadas va al servidor medido hace mas tiempo.
+    # Asi un servidor con una medicion vieja (por ejemplo de una llamada
+    # lenta aislada) vuelve a recibir llamadas y se actualiza.
+    DECAY_TIME = 1
+    EXPLORE_RATE = 0.02
+
+    # Una llamada fallida se registra como una medicion de FAILURE_PENALTY
+    # veces la latencia del servidor (o lo que tardo, si es mayor), para
+    # que un servidor que falla rapido no pase a ser el preferido.
+    FAILURE_PENALTY = 2
+
+    # Metodo con el que se prueba un servidor fuera de rotacion. Un fault
+    # tambien indica que el servidor responde.
+    probe_method = "system.listMethods"
+
+    # Configuracion que se copia a los clientes de cada servidor.
+    SHARED_SETTINGS = (
+        "user_agent", "buffer_size", "REGULAR_TIME", "OPERATIONAL_TIME",
+        "keep_alive", "accept_encoding", "compress_min_size",
+        "circuit_breaker", "files"
+    )
+
+    def __init__(self, endpoints):
+        super().__init__(None, None)
+        if not endpoints:
+            raise TypeError("No hay servidores.")
+        self.replicas = [Replica(address, port) for address, port in endpoints]
+        self.lock = Lock()
+        self.decayed = time.monotonic()
+
+    # Elige el servidor de la proxima llamada entre los que estan en
+    # rotacion, evitando los de 'tried' si hay otros, o retorna None si
+    # no hay ninguno. Se inician las pruebas de los que estan fuera de
+    # rotacion y ya pueden volver.
+    def choose(self, tried):
+        if self.circuit_breaker:
+            for replica in self.replicas:
+                breaker = replica.breaker
+                if breaker.state != "closed" and breaker.probe_due():
+                    self.probe(replica)
+
+        available = self.available()
+        self.refresh(available)
+        candidates = [
+            replica for replica in available if replica not in tried
+        ] or available
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        if random.random() < self.EXPLORE_RATE:
+            return min(
+                candidates,
+                key=lambda replica: replica.measured or 0
+            )
+        if self.balance == "least":
+            return min(
+                candidates,
+                key=lambda replica: (replica.outstanding, replica.latency)
+            )
+        first, second = random.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+
+    # Da el valor inicial a las latencias de los servidores de 'replicas'
+    # que no tienen y acerca las demas a su promedio segun el tiempo que
+    # paso desde la ultima vez.
+    def refresh(self, replicas):
+        with self.lock:
+            known = [
+                replica.latency for replica in replicas
+                if replica.latency is not None
+            ]
+            mean = sum(known) / len(known) if known else self.INITIAL_LATENCY
+            now = time.monotonic()
+            factor = 0.5 ** ((now - self.decayed) / self.DECAY_TIME)
+            self.decayed = now
+            for replica in replicas:
+                if replica.latency is None:
+                    replica.latency = mean
+                else:
+                    replica.latency = mean + factor * (replica.latency - mean)
+
+    # Retorna los servidores que estan en rotacion.
+    def available(self):
+        return [
+            replica for replica in self.replicas
+            if not self.circuit_breaker or replica.breaker.state == "closed"
+        ]
+
+    # Prueba en otro hilo si un servidor fuera de rotacion volvio a
+    # responder; el resultado queda en su circuit breaker. Si vuelve a
+    # rotacion se descartan las mediciones de las llamadas fallidas.
+    def probe(self, replica):
+        with self.lock:
+            if replica.probing:
+                return
+            replica.probing = True
+        Thread(target=self.run_probe, args=(replica, ), daemon=True).start()
+
+    def run_probe(self, replica):
+        client = Client(replica.address, replica.port)
+        client.retries = 0
+        client.keep_alive = False
+        try:
+            client.call(self.probe_method, [])
+        except Exception:
+            pass
+        finally:
+            if replica.breaker.state == "closed":
+                with self.lock:
+                    replica.latency = None
+            replica.probing = False
+
+    # Retorna el cliente de 'replica' con la configuracion de este.
+    def replica_client(self, replica):
+        client = replica.client
+        for name in self.SHARED_SETTINGS:
+            setattr(client, name, getattr(self, name))
+        client.binary = self.binary and not replica.binary_rejected
+        client.retries = 0
+        return client
+
+    # Registra el fin de una llamada a 'replica' que tardo 'elapsed'
+    # segundos, e indica si fallo.
+    def finish(self, replica, elapsed, failed=False):
+        with self.lock:
+            replica.outstanding -= 1
+            replica.measured = time.monotonic()
+            if failed:
+                elapsed = max(elapsed, replica.latency) * self.FAILURE_PENALTY
+            replica.latency += self.EWMA_WEIGHT * (elapsed - replica.latency)
+
+    # Ejecuta 'method' en alguno de los servidores y retorna el resultado,
+    # terminando en 'timeout' segundos (por defecto self.timeout). Si no
+    # hay servidores en rotacion se levanta CircuitOpenError.
+    def call(self, method, params, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        tried = []
+        attempt = 0
+        while True:
+            replica = self.choose(tried)
+            if replica is None:
+                raise CircuitOpenError(CIRCUIT_ERROR)
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise TimeoutError(TIMEOUT_ERROR)
+
+            client = self.replica_client(replica)
+            with self.lock:
+                replica.outstanding += 1
+            start = time.monotonic()
+            failed = False
+            try:
+                return client.call(method, params, timeout)
+            except Exception as ex:
+                if not is_failure(ex):
+                    raise
+                failed = True
+                delay = self.retry_delay(method, ex, attempt, deadline)
+                if delay is None:
+                    raise
+            finally:
+                self.finish(replica, time.monotonic() - start, failed)
+                if self.binary and not client.binary:
+                    replica.binary_rejected = True
+
+            # Se reintenta en otro servidor, esperando solo si ya se
+            # probaron todos los que siguen en rotacion.
+            replica.breaker.retry()
+            tried.append(replica)
+            available = self.available()
+            if available and all(other in tried for other in available):
+                tried = []
+                time.sleep(delay)
+            attempt += 1
 
 
 def connect(address, port):
     return Client(address, port)
+
+
+def connect_async(address, port):
+    return AsyncClient(address, port)
+
+
+# Retorna un cliente que reparte las llamadas entre los servidores de
+# 'endpoints', una lista de (direccion, puerto).
+def connect_pool(endpoints):
+    return ReplicaClient(endpoints)
@@ -1,26 +1,57 @@
 import re
+import time
+import zlib
 import datetime as dt
 
 LF_CHAR = chr(10)
 CR_CHAR = chr(13)
 SP_CHAR = chr(32)
 FINISH_LINE = CR_CHAR + LF_CHAR
-LF_NUM = 10
-CR_NUM = 13
-SP_NUM = 32
-CL_NUM = ord(":")
+HEAD_END = (FINISH_LINE + FINISH_LINE).encode()
+CRLF_BYTES = FINISH_LINE.encode()
+SP_BYTES = SP_CHAR.encode()
 
 HTTP_METHODS = ["GET", "POST", "PUT", "DELETE", "HEAD"]
 
-GENERAL_HEADERS = ["Connection", "Content-Type", "Content-Length"]
+GENERAL_HEADERS = [
+    "Connection", "Content-Type", "Content-Length", "Content-Encoding"
+]
 
 REQUEST_HEADERS = [
-    "Host", "User-Agent", "Accept-Language", "Cookies", "Accept"
+    "Host", "User-Agent", "Accept-Language", "Cookies", "Accept",
+    "Accept-Encoding"
 ] + GENERAL_HEADERS
 NECESSARY_REQUEST_HEADERS = [
     "Content-Type", "Host", "User-Agent", "Content-Length"
 ]
 
+# Tipos de contenido soportados: XMLRPC y la codificacion binaria de
+# binary_utilities, que solo usan los clientes y servidores xmlrcp.
+XML_CONTENT_TYPE = "text/xml"
+BINARY_CONTENT_TYPE = "application/x-xmlrcp"
+CONTENT_TYPES = [XML_CONTENT_TYPE, BINARY_CONTENT_TYPE]
+
+# Codificaciones de contenido soportadas, con el parametro wbits de zlib
+# de cada una.
+CONTENT_ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Tamaño maximo de las partes que produce Decompressor.
+CHUNK_SIZE = 65536
+
+# Frase de cada codigo de estado de los HTTP response.
+REASON_PHRASES = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+    505: "HTTP Version Not Supported",
+}
+
 RESPONSE_HEADERS = [
     "Server", "Date", "Last-Modified", "Set-Cookie"
 ] + GENERAL_HEADERS
@@ -40,46 +71,81 @@ def current_time():
     return date
 
 
-# Lee caracteres hasta que llege al caracter 'char'.
-def read_chars_until(data, pos, char):
-    try:
-        new_pos = data.index(char, pos)
-    except Exception:
+# Ultimo valor del header Date, y el segundo al que corresponde.
+date_cache = (None, b"")
+
+
+# Retorna current_time() en bytes, calculandolo a lo sumo una vez por
+# segundo.
+def current_date():
+    global date_cache
+    second = int(time.time())
+    if date_cache[0] != second:
+        date_cache = (second, current_time().encode())
+    return date_cache[1]
+
+
+# Retorna el valor del header Content-Length de un bloque de headers
+# en bytes, sin validar el resto del mensaje. Si el header no esta o
+# no es valido retorna 0.
+def peek_content_length(head):
+    for line in head.split(CRLF_BYTES):
+        name, _, value = line.partition(b":")
+        if name == b"Content-Length":
+            try:
+                return max(int(value), 0)
+            except ValueError:
+                return 0
+    return 0
+
+
+# Retorna el largo total del mensaje HTTP que comienza en 'data', o None
+# si todavia no se recibieron todos los headers.
+def message_length(data):
+    end = data.find(HEAD_END)
+    if end == -1:
+        return None
+    return end + len(HEAD_END) + peek_content_length(data[:end])
+
+
+# Lee el texto de 'data' desde 'pos' hasta el separador 'sep' (en
+# bytes), retornandolo junto con la posicion siguiente al separador.
+def read_until(data, pos, sep):
+    new_pos = data.find(sep, pos)
+    if new_pos == -1:
         raise HTTPException(400)
-    read = "".join([chr(x) for x in data[pos:new_pos]])
-    return [read, new_pos + 1]
+    return [data[pos:new_pos].decode("latin-1"), new_pos + len(sep)]
 
 
-def read_header(data, pos, headers):
-    # Leyendo nombre del header
-    ret = read_chars_until(data, pos, CL_NUM)
-    header = ret[0]
-    pos = ret[1]
-    if header not in headers or data[ret[1]] != SP_NUM:
+# Valida la version de HTTP de la linea inicial del mensaje.
+def read_version(version):
+    if not re.fullmatch(r"HTTP/\d\.\d", version):
         raise HTTPException(400)
-    pos = ret[1] + 1
+    version = float(version[-3:])
+    if version > 1.1:
+        raise HTTPException(505)
+    return version
 
-    # Leyendo valor del header
-    ret = read_chars_until(data, pos, CR_NUM)
 
-    # Leer el caracter lf final de la linea.
-    pos = ret[1]
-    if data[pos] != LF_NUM:
+# Lee los headers que comienzan en 'pos' y los valida. Retorna un
+# diccionario con ellos, el largo del cuerpo segun Content-Length y la
+# posicion en la que comienza el cuerpo.
+def read_validate_headers(data, pos, headers, necessary_headers):
+    end = data.find(HEAD_END, pos - len(FINISH_LINE))
+    if end == -1:
         raise HTTPException(400)
 
-    return [{header: ret[0]}, pos + 1]
-
-
-def read_validate_headers(data, pos, headers, necessary_headers):
     # Lectura de los headers.
     headers_info = {}
-    while data[pos] != CR_NUM or data[pos + 1] != LF_NUM:
-        ret = read_header(data, pos, headers)
-        pos = ret[1]
-        headers_info.update(ret[0])
-
-    pos += 2
-    ret = "".join([chr(x) for x in data[pos:]])
+    if end >= pos:
+        for line in data[pos:end].split(CRLF_BYTES):
+            name, sep, value = line.partition(b":")
+            name = name.decode("latin-1")
+            if not sep or name not in headers or value[:1] != b" ":
+                raise HTTPException(400)
+            if CR_CHAR.encode() in value:
+                raise HTTPException(400)
+            headers_info[name] = value[1:].decode("latin-1")
 
     # Comprobacion del headers necesarios.
     for header in necessary_headers:
@@ -88,145 +154,320 @@ def read_validate_headers(data, pos, headers, necessary_headers):
 
     # Comprobacion de informacion de los campos.
     # Tipo del contenido.
-    if headers_info["Content-Type"] != "text/xml":
+    if headers_info["Content-Type"] not in CONTENT_TYPES:
         raise HTTPException(415)
     # Largo del contenido.
     try:
         length = int(headers_info["Content-Length"])
-        if len(ret) != length:
-            raise HTTPException(400)
-    except Exception:
+    except ValueError:
         raise HTTPException(400)
+    if length < 0:
+        raise HTTPException(400)
+    # Codificacion del contenido.
+    encoding = headers_info.get("Content-Encoding", "identity").lower()
+    if encoding == "identity":
+        encoding = None
+    elif encoding not in CONTENT_ENCODINGS:
+        raise HTTPException(415)
 
-    return ret
-
-
-# Funcion que discecciona el POST HTTP response en el mensaje XML RPC,
-# Lanzando error en caso de que sea necesario. Los datos tienen que
-# ser pasados en Bytes.
-def unwrap_http_response(data):
-    data = [int(char) for char in data]
-    pos = 0
+    return {
+        "headers": headers_info,
+        "length": length,
+        "encoding": encoding,
+        "content_type": headers_info["Content-Type"],
+        "start": end + len(HEAD_END)
+    }
+
+
+# Retorna el cuerpo del mensaje como un memoryview de 'data', sin
+# copiarlo, comprobando que su largo coincida con Content-Length. Un
+# cuerpo comprimido se retorna descomprimido.
+def read_body(data, head):
+    body = memoryview(data)[head["start"]:]
+    if len(body) != head["length"]:
+        raise HTTPException(400)
+    if head["encoding"] is not None:
+        try:
+            body = zlib.decompress(body, CONTENT_ENCODINGS[head["encoding"]])
+        except zlib.error:
+            raise HTTPException(400)
+    return body
+
+
+# Retorna la codificacion soportada preferida por un header
+# Accept-Encoding, o None si no acepta ninguna.
+def accepted_encoding(value):
+    best = None
+    best_quality = 0
+    for item in value.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        quality = 1
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        if name in CONTENT_ENCODINGS and quality > best_quality:
+            best = name
+            best_quality = quality
+    return best
+
+
+# Comprime las partes de 'chunks' con 'encoding' a medida que se recorre.
+# Cada parte se libera de la lista luego de comprimirla, para no tener el
+# cuerpo original y el comprimido completos a la vez.
+def compress_chunks(chunks, encoding):
+    comp = zlib.compressobj(6, zlib.DEFLATED, CONTENT_ENCODINGS[encoding])
+    for i in range(len(chunks)):
+        data = comp.compress(chunks[i])
+        chunks[i] = None
+        if data:
+            yield data
+    yield comp.flush()
+
+
+class Decompressor(object):
+    # Descomprime un cuerpo a medida que llega y le pasa el resultado a
+    # 'sink' en partes de a lo sumo CHUNK_SIZE bytes. Si los datos no son
+    # validos (400) o el resultado supera 'max_size' bytes (413) se deja
+    # de descomprimir, y el error se levanta en close().
+
+    def __init__(self, encoding, sink, max_size=None):
+        self.decomp = zlib.decompressobj(CONTENT_ENCODINGS[encoding])
+        self.sink = sink
+        self.max_size = max_size
+        self.size = 0
+        self.error = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise HTTPException(413)
+        self.sink(data)
+
+    def feed(self, data):
+        if self.error is not None:
+            return
+        try:
+            data = self.decomp.decompress(data, CHUNK_SIZE)
+            while data:
+                self.write(data)
+                data = self.decomp.decompress(
+                    self.decomp.unconsumed_tail,
+                    CHUNK_SIZE
+                )
+        except zlib.error:
+            self.error = HTTPException(400)
+        except HTTPException as ex:
+            self.error = ex
+
+    def close(self):
+        if self.error is None:
+            try:
+                data = self.decomp.flush()
+                if data:
+                    self.write(data)
+                if not self.decomp.eof:
+                    self.error = HTTPException(400)
+            except zlib.error:
+                self.error = HTTPException(400)
+            except HTTPException as ex:
+                self.error = ex
+        if self.error is not None:
+            raise self.error
+
+
+# Determina si la conexion se mantiene abierta luego del mensaje. En
+# HTTP/1.1 es persistente salvo 'Connection: close', y en HTTP/1.0 solo
+# si se pide 'Connection: keep-alive'.
+def is_keep_alive(version, headers):
+    connection = headers.get("Connection", "").lower()
+    if version >= 1.1:
+        return connection != "close"
+    return connection == "keep-alive"
+
+
+# Valida la linea inicial y los headers de un HTTP response, sin leer
+# el cuerpo. Retorna la version, los headers, el largo del cuerpo y la
+# posicion en la que comienza.
+def read_response_head(data):
 
     # Lectura y validacion de version de HTTP.
-    ret = read_chars_until(data, pos, SP_NUM)
-    version = ret[0]
-    if re.fullmatch(r"HTTP/\d\.\d", version):
-        version = float(version[-3:])
-        if version > 1.1:
-            raise HTTPException(505)
-    else:
-        raise HTTPException(400)
-    pos = ret[1]
+    ret = read_until(data, 0, SP_BYTES)
+    version = read_version(ret[0])
 
     # Lectura de codigo.
-    ret = read_chars_until(data, pos, SP_NUM)
-    code = ret[0]
-    code = int(code)
+    ret = read_until(data, ret[1], SP_BYTES)
+    code = int(ret[0])
     if code > 600 or code < 100:
         raise Exception()
-    pos = ret[1]
 
     # Lectura de frase.
-    ret = read_chars_until(data, pos, CR_NUM)
-    pos = ret[1]
-    if data[pos] != LF_NUM:
+    ret = read_until(data, ret[1], CRLF_BYTES)
+    if CR_CHAR in ret[0]:
         raise HTTPException(400)
-    pos += 1
 
-    return read_validate_headers(
+    ret = read_validate_headers(
         data,
-        pos,
+        ret[1],
         RESPONSE_HEADERS,
         NECESSARY_RESPONSE_HEADERS
     )
+    ret["version"] = version
+    ret["code"] = code
+    return ret
 
 
-# Funcion que discecciona el POST HTTP request en el mensaje XML RPC,
-# Lanzando error en caso de que sea necesario. Los datos tienen que
-# ser pasados en Bytes.
-def unwrap_http_request(data):
-    data = [int(char) for char in data]
-    pos = 0
+# Valida la linea inicial y los headers de un HTTP request, sin leer
+# el cuerpo. Retorna la version, los headers, el largo del cuerpo y la
+# posicion en la que comienza.
+def read_request_head(data):
 
     # Lectura y validacion de metodo utilizado.
-    ret = read_chars_until(data, pos, SP_NUM)
+    ret = read_until(data, 0, SP_BYTES)
     method = ret[0]
     if method not in HTTP_METHODS:
         raise HTTPException(400)
     elif method != "POST":
         raise HTTPException(501)
-    pos = ret[1]
 
     # Lectura de url.
-    ret = read_chars_until(data, pos, SP_NUM)
-    pos = ret[1]
+    ret = read_until(data, ret[1], SP_BYTES)
 
     # Lectura y validacion de version de HTTP.
-    ret = read_chars_until(data, pos, CR_NUM)
-    version = ret[0]
-    if re.fullmatch(r"HTTP/\d\.\d", version):
-        version = float(version[-3:])
-        if version > 1.1:
-            raise HTTPException(505)
-    else:
-        raise HTTPException(400)
-
-    pos = ret[1]
-    if data[pos] != LF_NUM:
-        raise HTTPException(400)
-    pos += 1
+    ret = read_until(data, ret[1], CRLF_BYTES)
+    version = read_version(ret[0])
 
-    return read_validate_headers(
+    ret = read_validate_headers(
         data,
-        pos,
+        ret[1],
         REQUEST_HEADERS,
         NECESSARY_REQUEST_HEADERS
     )
+    ret["version"] = version
+    return ret
+
+
+# Funcion que discecciona el POST HTTP response en el mensaje XML RPC,
+# Lanzando error en caso de que sea necesario. Los datos tienen que
+# ser pasados en Bytes, y el cuerpo se retorna como un memoryview de
+# ellos. Con 'with_headers' se retorna tambien la version y los headers
+# del mensaje.
+def unwrap_http_response(data, with_headers=False):
+    head = read_response_head(data)
+    body = read_body(data, head)
+    if not with_headers:
+        return body
+    return {
+        "version": head["version"],
+        "headers": head["headers"],
+        "data": body
+    }
+
+
+# Funcion que discecciona el POST HTTP request en el mensaje XML RPC,
+# Lanzando error en caso de que sea necesario. Los datos tienen que
+# ser pasados en Bytes, y el cuerpo se retorna como un memoryview de
+# ellos. Con 'with_headers' se retorna tambien la version y los headers
+# del mensaje.
+def unwrap_http_request(data, with_headers=False):
+    head = read_request_head(data)
+    body = read_body(data, head)
+    if not with_headers:
+        return body
+    return {
+        "version": head["version"],
+        "headers": head["headers"],
+        "data": body
+    }
+
+
+def connection_value(keep_alive):
+    return "keep-alive" if keep_alive else "close"
+
+
+# Principio de los headers del HTTP response ya armado, hasta el valor de
+# Content-Length, para cada codigo, servidor, tipo de conexion y
+# codificacion del contenido.
+head_templates = {}
+
+
+def http_response_template(code, server_name, keep_alive, encoding=None):
+    key = (code, server_name, keep_alive, encoding)
+    template = head_templates.get(key)
+    if template is None:
+        phrase = REASON_PHRASES.get(code, "")
+        template = "HTTP/1.1 " + str(code) + " " + phrase + FINISH_LINE
+        template += "Server: " + server_name + FINISH_LINE
+        template += "Connection: " + connection_value(keep_alive) + FINISH_LINE
+        if encoding is not None:
+            template += "Content-Encoding: " + encoding + FINISH_LINE
+        template += "Content-Length: "
+        template = template.encode()
+        head_templates[key] = template
+    return template
+
+
+# funcion que crea los headers del HTTP response para un cuerpo de
+# 'length' bytes, comprimido con 'encoding' si se indica.
+def http_response_head(length, code, server_name, keep_alive=False,
+                       encoding=None, content_type=XML_CONTENT_TYPE):
+    return b"%s%d\r\nContent-Type: %s\r\nDate: %s\r\n\r\n" % (
+        http_response_template(code, server_name, keep_alive, encoding),
+        length,
+        content_type.encode(),
+        current_date()
+    )
 
 
 # funcion que crea un HTTP response para el mensaje XML RPC.
-def wrap_http_response(data, code, server_name):
-    phrase = ""
-    if code == 200:
-        phrase = "OK"
-    elif code == 201:
-        phrase = "Created"
-    elif code == 400:
-        phrase = "Bad Request"
-    elif code == 404:
-        phrase = "Not Found"
-    elif code == 415:
-        phrase = "Unsupported Media Type"
-    elif code == 500:
-        phrase = "Internal Server Error"
-    elif code == 505:
-        phrase = "HTTP Version Not Supported"
-    elif code == 501:
-        phrase = "Not Implemented"
-
-    ret = "HTTP/1.1 " + str(code) + " " + phrase + FINISH_LINE
-    ret += "Server: " + server_name + FINISH_LINE
-    ret += "Connection: close" + FINISH_LINE
-    ret += "Content-Length: " + str(len(data)) + FINISH_LINE
-    ret += "Content-Type: text/xml" + FINISH_LINE
-    ret += "Date: " + current_time() + FINISH_LINE
-    ret += FINISH_LINE
-    ret = ret.encode()
+def wrap_http_response(data, code, server_name, keep_alive=False,
+                       encoding=None, content_type=XML_CONTENT_TYPE):
+    ret = http_response_head(
+        len(data),
+        code,
+        server_name,
+        keep_alive,
+        encoding,
+        content_type
+    )
     ret += data
     return ret
 
 
-# funcion que crea un HTTP reques para el mensaje XML RPC.
-def wrap_http_request(data, user_agent):
+# funcion que crea los headers del HTTP request para un cuerpo de
+# 'length' bytes. 'encoding' es la codificacion con la que ya esta
+# comprimido el cuerpo, y 'accept_encoding' las que se aceptan para el
+# response.
+def http_request_head(length, user_agent, keep_alive=False, encoding=None,
+                      accept_encoding=None, content_type=XML_CONTENT_TYPE):
     ret = "POST / HTTP/1.1" + FINISH_LINE
     ret += "Host: Servidor.com" + FINISH_LINE
-    ret += "Connection: close" + FINISH_LINE
+    ret += "Connection: " + connection_value(keep_alive) + FINISH_LINE
     ret += "User-Agent: " + user_agent + FINISH_LINE
     ret += "Accept-Language: en" + FINISH_LINE
-    ret += "Content-Type: text/xml" + FINISH_LINE
-    ret += "Content-Length: " + str(len(data)) + FINISH_LINE
+    if accept_encoding is not None:
+        ret += "Accept-Encoding: " + accept_encoding + FINISH_LINE
+    ret += "Content-Type: " + content_type + FINISH_LINE
+    if encoding is not None:
+        ret += "Content-Encoding: " + encoding + FINISH_LINE
+    ret += "Content-Length: " + str(length) + FINISH_LINE
     ret += FINISH_LINE
-    ret = ret.encode()
+    return ret.encode()
+
+
+# funcion que crea un HTTP reques para el mensaje XML RPC.
+def wrap_http_request(data, user_agent, keep_alive=False, encoding=None,
+                      accept_encoding=None, content_type=XML_CONTENT_TYPE):
+    ret = http_request_head(
+        len(data),
+        user_agent,
+        keep_alive,
+        encoding,
+        accept_encoding,
+        content_type
+    )
     ret += data
     return ret
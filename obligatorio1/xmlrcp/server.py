@@ -1,8 +1,93 @@
+import os
+import inspect
+import signal
 import socket
+import select
+import asyncio
+import queue
+import time
 from threading import Thread
 from . import http_utilities
 from . import xmlrpc_utilities
 from . import socket_functions
+from . import binary_utilities
+from .cache import ResultCache, cache_key
+from .stats import StageStats, NULL_TIMER
+
+
+# Descarta los datos recibidos.
+def discard(data):
+    pass
+
+
+# Funciones de cada codificacion de los mensajes, segun su Content-Type.
+CODECS = {
+    http_utilities.XML_CONTENT_TYPE: {
+        "content_type": http_utilities.XML_CONTENT_TYPE,
+        "parser": xmlrpc_utilities.XmlRpcParser,
+        "response": xmlrpc_utilities.iter_xmlrpc_response,
+        "error": xmlrpc_utilities.write_xmlrpc_error
+    },
+    http_utilities.BINARY_CONTENT_TYPE: {
+        "content_type": http_utilities.BINARY_CONTENT_TYPE,
+        "parser": binary_utilities.BinaryParser,
+        "response": binary_utilities.iter_binary_response,
+        "error": binary_utilities.write_binary_error
+    }
+}
+XML_CODEC = CODECS[http_utilities.XML_CONTENT_TYPE]
+
+
+# Retorna la cantidad minima y maxima de parametros posicionales que
+# acepta 'function' (maxima None si no tiene limite), o None si no se
+# puede determinar.
+def read_arity(function):
+    try:
+        sig = inspect.signature(function)
+    except (TypeError, ValueError):
+        return None
+
+    low, high = 0, 0
+    for param in sig.parameters.values():
+        if param.kind == param.VAR_POSITIONAL:
+            high = None
+        elif param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            if param.default is param.empty:
+                low += 1
+            if high is not None:
+                high += 1
+    return low, high
+
+
+# Construye la funcion que valida los parametros de un metodo, a partir de
+# su aridad y de los tipos esperados para cada parametro ('types', una
+# secuencia de tipos o tuplas de tipos). Retorna None si no hay nada que
+# validar.
+def compile_validator(arity, types=None):
+    types = tuple(types or ())
+    if arity is None:
+        low, high = len(types), None
+    else:
+        low, high = arity
+        if high is not None and len(types) > high:
+            raise TypeError("Hay mas tipos que parametros.")
+
+    if not types:
+        if arity is None:
+            return None
+        if high is None:
+            return lambda params: len(params) >= low
+        return lambda params: low <= len(params) <= high
+
+    def validate(params):
+        if len(params) < low or (high is not None and len(params) > high):
+            return False
+        for param, expected in zip(params, types):
+            if not isinstance(param, expected):
+                return False
+        return True
+
+    return validate
 
 
 class Server(object):
@@ -15,9 +100,48 @@ class Server(object):
     # Tiempo en segundos que espera antes de retornar timeout.
     REGULAR_TIME = 0.5
 
+    # Tiempo en segundos que una conexion persistente puede estar inactiva
+    # y cantidad maxima de requests que se atienden en ella.
+    KEEP_ALIVE_TIME = 5
+    keep_alive_max = 100
+
+    # Tamaño maximo en bytes de los headers y del cuerpo de un request. Los
+    # que lo superan se rechazan con 413 sin terminar de leerlos.
+    max_header_size = 8192
+    max_body_size = 16 * 1024 * 1024
+
+    # Cantidad maxima de bytes que se descartan de un request rechazado
+    # despues de enviar el response, para que al cerrar la conexion con
+    # datos sin leer el cliente no pierda el response.
+    linger_size = 65536
+
+    # Tiempo maximo en segundos que se descartan los requests que el
+    # cliente envio despues del ultimo de una conexion persistente, antes
+    # de cerrarla.
+    LINGER_TIME = 2
+
+    # Largo minimo en bytes del cuerpo de un response para comprimirlo,
+    # si el cliente acepta alguna codificacion.
+    compress_min_size = 1024
+
     # Nombre asociado al servidor, utilizado en la HTTP response.
     SERVER_NAME = "PythonPrueba/1.1.1"
 
+    # Cantidad maxima de requests de una conexion que se pueden estar
+    # atendiendo a la vez en serve_async, cuando el cliente envia varios
+    # sin esperar los responses.
+    pipeline_depth = 16
+
+    # Cantidad de hilos del pool y largo maximo de la cola de conexiones
+    # aceptadas que esperan un hilo, utilizados por serve_pool.
+    pool_workers = 8
+    pool_queue_length = 32
+
+    # Tiempo minimo en segundos que debe vivir un proceso de serve_prefork
+    # para que se reinicie inmediatamente al terminar. Si muere antes se
+    # espera este tiempo, para no reiniciarlo en bucle.
+    RESTART_TIME = 1
+
     def __init__(self, info):
 
         # Creacion del server socket.
@@ -28,56 +152,365 @@ class Server(object):
         # Lista de threads que estan vivos.
         self.threads_alive = []
 
-    def handler(self, conn):
-        conn.settimeout(self.REGULAR_TIME)
+        # Cola de conexiones del pool y contadores de admision.
+        self.pending = None
+        self.accepted = 0
+        self.rejected = 0
 
-        # recepción y procesamiento de datos.
-        readed = socket_functions.read_socket(conn, self.buffer_size)
-        if not readed["status"]:
-            conn.close()
-            return
-        http_req = readed["data"]
+        # Histogramas del tiempo de cada etapa de los requests, si se
+        # activan con enable_stats.
+        self.stage_stats = None
+
+        # Metodos que se pueden invocar, por nombre.
+        self.methods = {}
 
-        # Descompresion de HTTP.
-        code = 200
+        # Metodos propios del servidor.
+        self.add_method(self.multicall, name="multicall", namespace="system",
+                        types=(list, ))
+        self.add_method(self.list_methods, name="listMethods",
+                        namespace="system")
+        self.add_method(self.stats, name="stats", namespace="system")
+
+    # Valida los headers del HTTP request. Si son validos retorna, junto
+    # al codigo HTTP y si la conexion se mantiene abierta, el largo del
+    # cuerpo en 'length', el decodificador XMLRPC en 'parser' y la funcion
+    # a la que pasarle el cuerpo en 'feed'. Si no, retorna el cuerpo de la
+    # respuesta de error en 'data'.
+    def decode_head(self, head):
         try:
-            data = http_utilities.unwrap_http_request(http_req)
+            req = http_utilities.read_request_head(head)
         except http_utilities.HTTPException as ex:
-            data = "".encode()
-            code = ex.value
-        else:
+            return {"code": ex.value, "keep_alive": False, "data": []}
+        if req["length"] > self.max_body_size:
+            return {"code": 413, "keep_alive": False, "data": []}
+        keep_alive = http_utilities.is_keep_alive(
+            req["version"],
+            req["headers"]
+        )
+
+        # El cuerpo se le pasa al decodificador de su Content-Type con
+        # 'feed', a traves del descompresor si esta comprimido.
+        codec = CODECS[req["content_type"]]
+        parser = codec["parser"]("methodCall", self.receives_files)
+        decoder = None
+        feed = parser.feed
+        if req["encoding"] is not None:
+            decoder = http_utilities.Decompressor(
+                req["encoding"],
+                parser.feed,
+                self.max_body_size
+            )
+            feed = decoder.feed
+        return {
+            "code": 200,
+            "keep_alive": keep_alive,
+            "encoding": http_utilities.accepted_encoding(
+                req["headers"].get("Accept-Encoding", "")
+            ),
+            "start": req["start"],
+            "length": req["length"],
+            "codec": codec,
+            "parser": parser,
+            "decoder": decoder,
+            "feed": feed
+        }
 
-            # Descompresion de XML_RPC.
+    # Termina de decodificar un request al que ya se le paso el cuerpo
+    # ('size' bytes) al decodificador. Retorna, o bien el cuerpo de la
+    # respuesta en 'data' (en caso de error), o bien el metodo a ejecutar
+    # en 'method' junto a sus parametros.
+    def decode_body(self, req, size):
+        parser = req.pop("parser")
+        decoder = req.pop("decoder")
+        del req["feed"]
+        if size != req.pop("length"):
+            return {"code": 400, "keep_alive": False, "data": []}
+        if decoder is not None:
             try:
-                xml_rpc = xmlrpc_utilities.read_xmlrpc_request(data)
-            except Exception:
-                data = xmlrpc_utilities.write_xmlrpc_error(1)
+                decoder.close()
+            except http_utilities.HTTPException as ex:
+                return {"code": ex.value, "keep_alive": False, "data": []}
+
+        # Descompresion de XML_RPC. Los archivos de los valores base64 se
+        # cierran con close_files una vez respondido el request.
+        req["files"] = parser.opened
+        try:
+            xml_rpc = parser.close()
+        except Exception:
+            req["data"] = [req["codec"]["error"](1)]
+            return req
+        if xml_rpc["method"] == "system.multicall":
+            self.spool_multicall(xml_rpc["params"], req["files"])
+
+        # validar que el metodo exista y los parametros.
+        found = self.find_method(xml_rpc["method"], xml_rpc["params"])
+        if not found["status"]:
+            req["data"] = [req["codec"]["error"](found["fault"])]
+            return req
+
+        req.update({
+            "name": xml_rpc["method"],
+            "method": found["method"]["function"],
+            "blocking": found["method"]["blocking"],
+            "cache": found["method"]["cache"],
+            "params": xml_rpc["params"]
+        })
+        return req
+
+    # Busca el metodo 'name' y valida 'params' con su validador. Retorna
+    # el metodo registrado, o el codigo de fault si no existe (2) o los
+    # parametros no son validos (3).
+    def find_method(self, name, params):
+        method = self.methods.get(name)
+        if method is None:
+            return {"status": False, "fault": 2}
+        validate = method["validate"]
+        if validate is not None and not validate(params):
+            return {"status": False, "fault": 3}
+        return {"status": True, "method": method}
+
+    # Descomprime el HTTP request y el XMLRPC de un mensaje completo.
+    def decode_request(self, http_req):
+        req = self.decode_head(http_req)
+        if "parser" in req:
+            body = memoryview(http_req)[req["start"]:]
+            req["feed"](body)
+            req = self.decode_body(req, len(body))
+        return req
+
+    # Ejecuta el metodo y retorna el mensaje con el resultado o el error,
+    # codificado con 'codec', como una lista de partes en bytes. Con
+    # 'cache' se retorna el response guardado para los mismos parametros
+    # sin ejecutar el metodo, y los resultados correctos se guardan ya
+    # codificados. 'timer' mide la ejecucion y la codificacion.
+    def execute(self, method, params, cache=None, codec=XML_CODEC,
+                timer=NULL_TIMER):
+        if cache is not None:
+            key = (codec["content_type"], cache_key(params))
+            data = cache.get(key)
+            if data is not None:
+                return [data]
+
+        # validar que se puede obtener el resultado.
+        try:
+            data = method(*params)
+            timer.lap("method")
+            data = list(codec["response"](data))
+        except TypeError:
+            return [codec["error"](3)]
+        except Exception:
+            return [codec["error"](4)]
+        timer.lap("encode")
+
+        if cache is not None:
+            data = [b"".join(data)]
+            cache.put(key, data[0])
+        return data
+
+    # Arma el HTTP response de un request ya decodificado, como una lista
+    # con los headers y las partes del cuerpo, indicando si la conexion
+    # se mantiene abierta. El cuerpo se comprime si el cliente lo acepta y
+    # tiene al menos compress_min_size bytes.
+    def encode_response(self, req, requests):
+        keep_alive = req["keep_alive"] and requests < self.keep_alive_max
+        keep_alive = keep_alive and not self.pool_saturated()
+
+        data = req["data"]
+        encoding = req.get("encoding")
+        if encoding is not None:
+            if sum(len(part) for part in data) >= self.compress_min_size:
+                data = list(http_utilities.compress_chunks(data, encoding))
             else:
-                method = xml_rpc["method"]
-                params = xml_rpc["params"]
+                encoding = None
 
-                # validar que el metodo exista.
-                try:
-                    method = getattr(self, method)
-                except AttributeError:
-                    data = xmlrpc_utilities.write_xmlrpc_error(2)
-                else:
+        head = http_utilities.http_response_head(
+            sum(len(part) for part in data),
+            req["code"],
+            self.SERVER_NAME,
+            keep_alive,
+            encoding,
+            req.get("codec", XML_CODEC)["content_type"]
+        )
+        return {"data": [head] + data, "keep_alive": keep_alive}
+
+    # Implementacion de system.multicall. Recibe una lista de structs con
+    # 'methodName' y 'params' y retorna, para cada llamada, un array con
+    # su resultado o el struct del fault correspondiente. Se comprueba que
+    # cada resultado se pueda codificar, para que un error en una llamada
+    # no haga fallar a las demas.
+    def multicall(self, calls):
+        ret = []
+        for call in calls:
+            if type(call) is not dict or type(call.get("params")) is not list:
+                ret.append(xmlrpc_utilities.fault_value(3))
+                continue
+            name = call.get("methodName")
+            if name == "system.multicall" or type(name) is not str:
+                ret.append(xmlrpc_utilities.fault_value(2))
+                continue
+
+            data = self.multicall_one(name, call["params"])
+            if "fault" in data:
+                ret.append(xmlrpc_utilities.fault_value(data["fault"]))
+            elif xmlrpc_utilities.check_value(data["result"]):
+                ret.append([data["result"]])
+            else:
+                ret.append(xmlrpc_utilities.fault_value(4))
+        return ret
+
+    # Reemplaza por archivos los valores base64 de las llamadas de
+    # system.multicall ('params') a metodos con files=True, igual que si
+    # se llamaran directamente. Los archivos se agregan a 'opened', los
+    # del request, para que sigan abiertos hasta que se envie el response,
+    # ya que un metodo puede retornar el archivo que recibe.
+    def spool_multicall(self, params, opened):
+        if len(params) != 1 or type(params[0]) is not list:
+            return
+        for call in params[0]:
+            if type(call) is not dict or type(call.get("params")) is not list:
+                continue
+            name = call.get("methodName")
+            if type(name) is str and self.receives_files(name):
+                xmlrpc_utilities.spool_values(call["params"], opened)
+
+    # Ejecuta una de las llamadas de system.multicall y retorna su
+    # resultado en 'result', o el codigo del fault en 'fault'.
+    def multicall_one(self, name, params):
+        found = self.find_method(name, params)
+        if not found["status"]:
+            return {"fault": found["fault"]}
+        try:
+            return {"result": found["method"]["function"](*params)}
+        except TypeError:
+            return {"fault": 3}
+        except Exception:
+            return {"fault": 4}
+
+    # Ejecuta un request ya decodificado y retorna el HTTP response.
+    def complete_request(self, req, requests=1, timer=NULL_TIMER):
+        if "method" in req:
+            req["data"] = self.execute(
+                req["method"],
+                req["params"],
+                req["cache"],
+                req["codec"],
+                timer
+            )
+        self.close_files(req)
+        ret = self.encode_response(req, requests)
+        timer.lap("encode")
+        return ret
 
-                    # validar que se puede obtener el resultado.
-                    try:
-                        data = method(*params)
-                        data = xmlrpc_utilities.write_xmlrpc_response(data)
-                    except TypeError:
-                        data = xmlrpc_utilities.write_xmlrpc_error(3)
-                    except Exception:
-                        data = xmlrpc_utilities.write_xmlrpc_error(4)
+    # Cierra los archivos temporales de los valores base64 de un request.
+    def close_files(self, req):
+        for file in req.get("files", ()):
+            file.close()
 
-        # Envio de data.
-        data = http_utilities.wrap_http_response(data, code, self.SERVER_NAME)
-        socket_functions.send_socket(conn, data)
+    # Procesa un HTTP request completo y retorna el HTTP response.
+    def process_request(self, http_req, requests=1):
+        return self.complete_request(self.decode_request(http_req), requests)
+
+    # Retorna el timer de las etapas de un request, que no mide nada si
+    # las estadisticas no estan activadas.
+    def start_timer(self):
+        if self.stage_stats is None:
+            return NULL_TIMER
+        return self.stage_stats.timer()
+
+    # Registra los tiempos de un request ya respondido.
+    def record_request(self, req, timer):
+        if self.stage_stats is not None:
+            self.stage_stats.record(req.get("name"), timer)
+
+    def handler(self, conn):
+        conn.settimeout(self.REGULAR_TIME)
+        reader = socket_functions.MessageReader(conn, self.buffer_size)
+
+        # Se atienden requests en la misma conexion mientras el cliente la
+        # mantenga abierta.
+        requests = 0
+        while requests == 0 or self.wait_request(reader):
+
+            # recepción y procesamiento de datos. El cuerpo se le pasa al
+            # decodificador XMLRPC a medida que llega.
+            timer = self.start_timer()
+            head = reader.read_head(self.max_header_size)
+            if not head["status"] or not head["data"]:
+                break
+            timer.lap("read")
+            requests += 1
+            if head["too_large"]:
+                req = {"code": 413, "keep_alive": False, "data": []}
+            else:
+                req = self.decode_head(head["data"])
+            timer.lap("decode")
+            rejected = "parser" not in req
+            if not rejected:
+                body = reader.read_body(req["length"], req["feed"])
+                if not body["status"]:
+                    break
+                timer.lap("read")
+                req = self.decode_body(req, body["size"])
+                timer.lap("decode")
+            ret = self.complete_request(req, requests, timer)
+
+            # Envio de data.
+            sended = socket_functions.send_parts(conn, ret["data"])
+            if not sended["status"]:
+                break
+            timer.lap("send")
+            self.record_request(req, timer)
+            if rejected:
+                # El resto del request rechazado no se procesa.
+                self.linger(reader, self.linger_size)
+                break
+            if not ret["keep_alive"]:
+                # Si el cliente queria mantener la conexion pudo haber
+                # enviado mas requests, que se descartan antes de cerrar
+                # para que no pierda este response.
+                if req["keep_alive"]:
+                    self.linger(reader)
+                break
 
         conn.close()
 
+    # Cierra la escritura de la conexion y descarta lo que el cliente siga
+    # enviando, hasta 'limit' bytes o, sin limite, hasta que deje de
+    # enviar o pasen LINGER_TIME segundos.
+    def linger(self, reader, limit=None):
+        try:
+            reader.conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            return
+        if limit is not None:
+            reader.read_body(limit, discard)
+            return
+        end = time.monotonic() + self.LINGER_TIME
+        while time.monotonic() < end:
+            if not reader.read_body(65536, discard)["size"]:
+                return
+
+    # Espera el proximo request de una conexion persistente. En el modo
+    # pool se abandona la espera si hay conexiones esperando un hilo.
+    def wait_request(self, reader):
+        if reader.pending:
+            return True
+        waited = 0
+        while waited < self.KEEP_ALIVE_TIME:
+            readable, _, _ = select.select(
+                [reader.conn], [], [], self.REGULAR_TIME
+            )
+            if readable:
+                return True
+            if self.pool_saturated():
+                return False
+            waited += self.REGULAR_TIME
+        return False
+
+    # Indica si hay conexiones del pool esperando un hilo libre.
+    def pool_saturated(self):
+        return self.pending is not None and not self.pending.empty()
+
     def serve(self):
         while True:
             try:
@@ -97,9 +530,449 @@ class Server(object):
                     th.join()
                 return
 
-    def add_method(self, function):
-        setattr(self, function.__name__, function)
+    def pool_worker(self):
+        while True:
+            conn = self.pending.get()
+            if conn is None:
+                return
+            try:
+                self.handler(conn)
+            except Exception as ex:
+                print(ex)
+                conn.close()
+
+    # Responde 503 sin procesar el request, cuando la cola esta llena.
+    def reject(self, conn):
+        data = xmlrpc_utilities.write_xmlrpc_error(5)
+        head = http_utilities.http_response_head(
+            len(data),
+            503,
+            self.SERVER_NAME
+        )
+        conn.settimeout(self.REGULAR_TIME)
+        socket_functions.send_parts(conn, [head, data])
+        try:
+            conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        conn.close()
+
+    # Sirve las peticiones con un numero fijo de hilos. Las conexiones
+    # aceptadas esperan en una cola acotada; si esta llena se responde
+    # inmediatamente con 503 en lugar de encolar trabajo.
+    def serve_pool(self):
+        self.pending = queue.Queue(self.pool_queue_length)
+        workers = [
+            Thread(target=self.pool_worker) for _ in range(self.pool_workers)
+        ]
+        for th in workers:
+            th.start()
+
+        while True:
+            try:
+                # Sirviendo peticiones...
+                conn, _ = self.sock.accept()
+                try:
+                    self.pending.put_nowait(conn)
+                    self.accepted += 1
+                except queue.Full:
+                    self.rejected += 1
+                    self.reject(conn)
+            except KeyboardInterrupt:
+                # Esperando finalizacion de hilos.
+                for th in workers:
+                    self.pending.put(None)
+                for th in workers:
+                    th.join()
+                return
+
+    # Retorna los contadores del pool de hilos.
+    def pool_stats(self):
+        return {
+            "workers": self.pool_workers,
+            "queue_depth": self.pending.qsize() if self.pending else 0,
+            "accepted": self.accepted,
+            "rejected": self.rejected
+        }
+
+    # Ejecuta 'target' (uno de los modos de servir) en un proceso hijo.
+    # SIGTERM se convierte en KeyboardInterrupt para que el modo termine
+    # como lo hace con Ctrl-C, esperando a las conexiones en curso.
+    def fork_worker(self, target):
+        pid = os.fork()
+        if pid:
+            return pid
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt()
+
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            target()
+        except KeyboardInterrupt:
+            pass
+        except Exception as ex:
+            print(ex)
+            code = 1
+        finally:
+            os._exit(code)
+
+    # Sirve las peticiones con 'processes' procesos (por defecto uno por
+    # nucleo) que aceptan conexiones del mismo socket, para que los
+    # metodos que usan CPU no queden limitados por el GIL. Cada proceso
+    # ejecuta 'target', por defecto serve, con los metodos agregados
+    # antes de llamar a esta funcion. Los procesos que terminan se
+    # reinician, SIGHUP los reinicia a todos y SIGTERM o Ctrl-C terminan
+    # el servidor esperando a que los procesos terminen. Requiere
+    # os.fork, por lo que no esta disponible en Windows.
+    def serve_prefork(self, processes=None, target=None):
+        processes = processes or os.cpu_count() or 1
+        target = target or self.serve
+        workers = {}
+        stopping = []
+
+        def signal_workers(signum, frame):
+            if signum == signal.SIGTERM:
+                stopping.append(signum)
+            for pid in list(workers):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        previous = {
+            signum: signal.signal(signum, signal_workers)
+            for signum in (signal.SIGTERM, signal.SIGHUP)
+        }
+        try:
+            for _ in range(processes):
+                workers[self.fork_worker(target)] = time.monotonic()
+
+            while workers:
+                try:
+                    pid, _ = os.wait()
+                except KeyboardInterrupt:
+                    signal_workers(signal.SIGTERM, None)
+                    continue
+                except ChildProcessError:
+                    break
+                started = workers.pop(pid, None)
+                if started is None or stopping:
+                    continue
+
+                # Reinicio del proceso que termino.
+                if time.monotonic() - started < self.RESTART_TIME:
+                    time.sleep(self.RESTART_TIME)
+                    if stopping:
+                        continue
+                workers[self.fork_worker(target)] = time.monotonic()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    # Lee los headers de un HTTP request de un stream de asyncio, hasta
+    # la linea vacia inclusive. 'pending' contiene los bytes leidos de mas
+    # en la lectura anterior y se actualiza con los de esta. Si el mensaje
+    # esta mal formado se retorna lo leido para que la validacion lo
+    # rechace, y si supera max_header_size se deja de leer. Si no habia
+    # bytes pendientes 'timer' empieza a medir cuando llegan los primeros,
+    # para no contar como lectura el tiempo que la conexion estuvo inactiva.
+    async def read_stream_head(self, reader, pending, timeout,
+                               timer=NULL_TIMER):
+        head = bytearray(pending)
+        del pending[:]
+        try:
+            end = head.find(http_utilities.HEAD_END)
+            while end == -1:
+                if len(head) > self.max_header_size:
+                    return {
+                        "data": head,
+                        "complete": False,
+                        "too_large": True
+                    }
+                rec = await asyncio.wait_for(
+                    reader.read(self.buffer_size),
+                    timeout
+                )
+                if not rec:
+                    return {"data": head, "complete": False, "too_large": False}
+                if not head:
+                    timer.restart()
+                head += rec
+                timeout = self.REGULAR_TIME
+                end = head.find(http_utilities.HEAD_END)
+        except asyncio.TimeoutError:
+            return {"data": head, "complete": False, "too_large": False}
+
+        end += len(http_utilities.HEAD_END)
+        if end > self.max_header_size:
+            return {"data": head, "complete": False, "too_large": True}
+        pending += head[end:]
+        del head[end:]
+        return {"data": head, "complete": True, "too_large": False}
+
+    # Lee un cuerpo de 'length' bytes de un stream de asyncio, pasando
+    # cada parte a 'sink'. Retorna la cantidad de bytes leidos.
+    async def read_stream_body(self, reader, pending, length, sink):
+        size = min(len(pending), length)
+        if size:
+            sink(bytes(pending[:size]))
+            del pending[:size]
+        try:
+            while size < length:
+                rec = await asyncio.wait_for(
+                    reader.read(min(length - size, 65536)),
+                    self.REGULAR_TIME
+                )
+                if not rec:
+                    break
+                sink(rec)
+                size += len(rec)
+        except asyncio.TimeoutError:
+            pass
+        return size
+
+    # Version de linger para los streams de asyncio.
+    async def linger_stream(self, reader, pending, limit=None):
+        if limit is not None:
+            await self.read_stream_body(reader, pending, limit, discard)
+            return
+        end = time.monotonic() + self.LINGER_TIME
+        while time.monotonic() < end:
+            size = await self.read_stream_body(reader, pending, 65536, discard)
+            if not size:
+                return
+
+    # Ejecuta un request ya decodificado en el event loop, o en el
+    # executor si es bloqueante. Retorna None si ya se ejecuto, o el
+    # future con el resultado si se esta ejecutando en el executor.
+    def dispatch(self, req, executor, timer):
+        if "method" not in req:
+            return None
+        if executor is not None and req["blocking"]:
+            loop = asyncio.get_running_loop()
+            return loop.run_in_executor(
+                executor,
+                self.execute,
+                req["method"],
+                req["params"],
+                req["cache"],
+                req["codec"],
+                timer
+            )
+        req["data"] = self.execute(
+            req["method"],
+            req["params"],
+            req["cache"],
+            req["codec"],
+            timer
+        )
+        return None
+
+    # Escribe en orden los responses de los requests de 'responses' a
+    # medida que terminan. Si la conexion falla se sigue vaciando la cola
+    # sin escribir, para no bloquear la lectura.
+    async def write_responses(self, writer, responses, state):
+        while True:
+            entry = await responses.get()
+            if entry is None:
+                return
+            req, future, timer, requests = entry
+            try:
+                if future is not None:
+                    req["data"] = await future
+                timer.lap("queue")
+                if state["failed"]:
+                    continue
+                ret = self.encode_response(req, requests)
+                timer.lap("encode")
+                writer.writelines(ret["data"])
+                await writer.drain()
+                timer.lap("send")
+                self.record_request(req, timer)
+            except (ConnectionError, OSError) as ex:
+                print(ex)
+                state["failed"] = True
+            finally:
+                self.close_files(req)
+                state["inflight"] -= 1
+
+    # Atiende una conexion. Los requests se leen y se despachan a medida
+    # que llegan, aunque el cliente no haya recibido los responses de los
+    # anteriores (HTTP pipelining), de forma que los metodos bloqueantes
+    # de requests seguidos se ejecutan a la vez en el executor. Los
+    # responses se escriben en orden desde write_responses, con a lo sumo
+    # pipeline_depth requests en curso.
+    async def async_handler(self, reader, writer, executor):
+        timeout = self.REGULAR_TIME
+        requests = 0
+        pending = bytearray()
+        responses = asyncio.Queue(self.pipeline_depth)
+        state = {"failed": False, "inflight": 0}
+        sender = asyncio.ensure_future(
+            self.write_responses(writer, responses, state)
+        )
+        linger = False
+        try:
+            while not state["failed"]:
+                timer = self.start_timer()
+                head = await self.read_stream_head(
+                    reader,
+                    pending,
+                    timeout,
+                    timer
+                )
+                if not head["data"]:
+                    # Mientras haya responses en curso la conexion no esta
+                    # inactiva.
+                    if state["inflight"] and not reader.at_eof():
+                        continue
+                    break
+                timer.lap("read")
+                requests += 1
+                if head["too_large"]:
+                    req = {"code": 413, "keep_alive": False, "data": []}
+                else:
+                    req = self.decode_head(head["data"])
+                timer.lap("decode")
+                rejected = "parser" not in req
+                if not rejected:
+                    size = await self.read_stream_body(
+                        reader,
+                        pending,
+                        req["length"],
+                        req["feed"]
+                    )
+                    timer.lap("read")
+                    req = self.decode_body(req, size)
+                    timer.lap("decode")
+
+                # Los metodos bloqueantes se ejecutan en el executor para
+                # no detener el loop.
+                future = self.dispatch(req, executor, timer)
+                state["inflight"] += 1
+                await responses.put((req, future, timer, requests))
+
+                # Despues de un request rechazado o del ultimo de la
+                # conexion no se leen mas; si el cliente pudo haber
+                # enviado otros, se descartan antes de cerrar.
+                if rejected:
+                    linger = self.linger_size
+                    break
+                if not req["keep_alive"]:
+                    break
+                if requests >= self.keep_alive_max:
+                    linger = None
+                    break
+                timeout = self.KEEP_ALIVE_TIME
+
+            await responses.put(None)
+            await sender
+            if linger is not False and not state["failed"]:
+                writer.write_eof()
+                await self.linger_stream(reader, pending, linger)
+        except (ConnectionError, OSError) as ex:
+            print(ex)
+        finally:
+            sender.cancel()
+            writer.close()
+
+    async def serve_loop(self, executor):
+        self.sock.setblocking(False)
+        server = await asyncio.start_server(
+            lambda r, w: self.async_handler(r, w, executor),
+            sock=self.sock
+        )
+        async with server:
+            await server.serve_forever()
+
+    # Sirve las peticiones con un unico hilo que ejecuta un event loop.
+    # Si se pasa un 'executor' (concurrent.futures), los metodos agregados
+    # con blocking=True se ejecutan en el.
+    def serve_async(self, executor=None):
+        try:
+            asyncio.run(self.serve_loop(executor))
+        except KeyboardInterrupt:
+            return
+
+    # Implementacion de system.listMethods.
+    def list_methods(self):
+        return sorted(self.methods)
+
+    # Registra 'function' para que se pueda invocar como 'name' (por
+    # defecto su nombre), dentro de 'namespace' si se indica, por ejemplo
+    # 'math.suma'. 'types' son los tipos esperados para cada parametro;
+    # junto a la aridad de la funcion se usan para construir una unica
+    # vez el validador de los parametros. Los metodos con blocking=True
+    # se ejecutan en el executor en el modo de event loop.
+    # Para metodos que solo dependen de sus parametros, 'cache' guarda los
+    # responses ya codificados: True usa una ResultCache por defecto, un
+    # entero una del tamaño indicado, y tambien se puede pasar una.
+    # Los metodos con files=True reciben los valores base64 como archivos
+    # temporales (SpooledTemporaryFile) en lugar de bytes, para no tener
+    # en memoria los parametros grandes. Los archivos se cierran despues
+    # de ejecutar el metodo. Estos metodos no pueden usar 'cache', ya que
+    # sus parametros no sirven como clave.
+    def add_method(self, function, blocking=False, name=None, namespace=None,
+                   types=None, cache=None, files=False):
+        name = name or function.__name__
+        if namespace:
+            name = namespace + "." + name
+
+        if cache is True:
+            cache = ResultCache()
+        elif type(cache) is int:
+            cache = ResultCache(cache)
+        elif cache is False:
+            cache = None
+        if cache is not None and files:
+            raise TypeError("Los metodos con files=True no pueden usar cache.")
+
+        arity = read_arity(function)
+        self.methods[name] = {
+            "function": function,
+            "blocking": blocking,
+            "arity": arity,
+            "types": tuple(types or ()),
+            "validate": compile_validator(arity, types),
+            "cache": cache,
+            "files": files
+        }
+
+    # Indica si el metodo 'name' recibe los valores base64 como archivos.
+    def receives_files(self, name):
+        method = self.methods.get(name)
+        return method is not None and method["files"]
+
+    # Retorna los contadores de la cache de cada metodo que tiene una.
+    def cache_stats(self):
+        return {
+            name: method["cache"].stats()
+            for name, method in self.methods.items()
+            if method["cache"] is not None
+        }
+
+    # Activa la medicion del tiempo de cada etapa de los requests (lectura,
+    # decodificacion, ejecucion del metodo, codificacion y envio), con un
+    # histograma por metodo. Los requests que tardan al menos 'slow_time'
+    # segundos se imprimen como lentos. En serve_prefork cada proceso
+    # tiene sus propias estadisticas.
+    def enable_stats(self, slow_time=None):
+        self.stage_stats = StageStats(slow_time)
+
+    # Implementacion de system.stats: los histogramas de las etapas (si
+    # estan activados), y los contadores de las caches y del pool.
+    def stats(self):
+        ret = {"cache": self.cache_stats(), "pool": self.pool_stats()}
+        if self.stage_stats is not None:
+            ret["stages"] = self.stage_stats.stats()
+        return ret
 
     def shutdown(self):
+        # El event loop cierra el socket al terminar.
+        if self.sock.fileno() == -1:
+            return
         self.sock.shutdown(socket.SHUT_RD)
         self.sock.close()
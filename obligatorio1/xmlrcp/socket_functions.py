@@ -1,4 +1,6 @@
+import time
 import socket
+from . import http_utilities
 
 
 def read_socket(conn, buffer_size):
@@ -18,14 +20,203 @@ def read_socket(conn, buffer_size):
     return {"status": status, "data": http_req}
 
 
+# Lector incremental de mensajes HTTP de una conexion. Los headers se
+# analizan a medida que llegan y el cuerpo se recibe con recv_into, ya
+# sea en un buffer reservado de una vez segun Content-Length o pasandolo
+# por partes a una funcion, terminando exactamente al final del mensaje.
+# Los bytes que se lean de mas (del mensaje siguiente) se guardan para la
+# proxima lectura. Con 'deadline' (en el reloj de time.monotonic) el
+# timeout de cada recv se acota al tiempo que queda, para que un mensaje
+# que llega de a poco no supere el limite.
+class MessageReader(object):
+    def __init__(self, conn, buffer_size, deadline=None):
+        self.conn = conn
+        self.buffer_size = buffer_size
+        self.pending = bytearray()
+        self.deadline = deadline
+
+    def recv_into(self, view):
+        if self.deadline is not None:
+            left = self.deadline - time.monotonic()
+            if left <= 0:
+                raise socket.timeout()
+            timeout = self.conn.gettimeout()
+            if timeout is None or timeout > left:
+                self.conn.settimeout(left)
+        return self.conn.recv_into(view)
+
+    # Lee los headers hasta la linea vacia inclusive. En 'complete' se
+    # indica si se encontro el fin de los headers; si no, 'data' tiene lo
+    # leido hasta que se cerro la conexion o se llego al timeout, que se
+    # indica en 'timeout'. Si los headers superan 'max_size' bytes se deja
+    # de leer y se indica en 'too_large'.
+    def read_head(self, max_size=None):
+        head = self.pending
+        self.pending = bytearray()
+        chunk = bytearray(self.buffer_size)
+        view = memoryview(chunk)
+        searched = 0
+        status = True
+        timeout = False
+        try:
+            while True:
+                end = head.find(http_utilities.HEAD_END, searched)
+                if end != -1:
+                    end += len(http_utilities.HEAD_END)
+                    if max_size is not None and end > max_size:
+                        break
+                    self.pending = head[end:]
+                    del head[end:]
+                    return {
+                        "status": status,
+                        "data": head,
+                        "complete": True,
+                        "too_large": False,
+                        "timeout": False
+                    }
+                searched = max(len(head) - len(http_utilities.HEAD_END) + 1, 0)
+                if max_size is not None and len(head) > max_size:
+                    break
+
+                size = self.recv_into(chunk)
+                if not size:
+                    break
+                head += view[:size]
+        except socket.timeout:
+            timeout = True
+        except socket.error as ex:
+            print(ex)
+            status = False
+        return {
+            "status": status,
+            "data": head,
+            "complete": False,
+            "too_large": max_size is not None and len(head) > max_size,
+            "timeout": timeout
+        }
+
+    # Lee hasta llenar 'view' o hasta que se cierre la conexion o se
+    # llegue al timeout, retornando la cantidad de bytes leidos.
+    def read_into(self, view):
+        size = min(len(self.pending), len(view))
+        view[:size] = self.pending[:size]
+        del self.pending[:size]
+        try:
+            while size < len(view):
+                rec = self.recv_into(view[size:])
+                if not rec:
+                    break
+                size += rec
+        except socket.timeout:
+            pass
+        return size
+
+    # Lee un cuerpo de 'length' bytes. Sin 'sink' se retorna en 'data';
+    # si no, cada parte se le pasa a 'sink' a medida que llega, sin
+    # guardar el cuerpo. En 'size' se indica cuantos bytes se leyeron.
+    def read_body(self, length, sink=None):
+        status = True
+        size = 0
+        try:
+            if sink is None:
+                data = bytearray(length)
+                size = self.read_into(memoryview(data))
+                del data[size:]
+                return {"status": status, "data": data, "size": size}
+
+            chunk = bytearray(min(length, max(self.buffer_size, 65536)))
+            view = memoryview(chunk)
+            while size < length:
+                rec = self.read_into(view[:min(len(chunk), length - size)])
+                if not rec:
+                    break
+                sink(view[:rec])
+                size += rec
+        except socket.error as ex:
+            print(ex)
+            status = False
+        return {"status": status, "data": None, "size": size}
+
+    # Lee un unico mensaje HTTP. Si el mensaje no tiene headers completos
+    # se retorna lo leido hasta que se cierre la conexion o se llegue al
+    # timeout, como en read_socket.
+    def read(self, max_size=None):
+        head = self.read_head(max_size)
+        if not head["status"] or not head["complete"]:
+            return {
+                "status": head["status"],
+                "data": head["data"],
+                "too_large": head["too_large"]
+            }
+        head = head["data"]
+
+        # Recepcion del cuerpo en el buffer reservado, a continuacion de
+        # los headers. El buffer se reserva segun el Content-Length que
+        # indica el otro extremo, por lo que con 'max_size' se limita.
+        length = http_utilities.peek_content_length(head)
+        if max_size is not None and len(head) + length > max_size:
+            return {"status": False, "data": head, "too_large": True}
+        data = bytearray(len(head) + length)
+        data[:len(head)] = head
+        status = True
+        try:
+            size = len(head) + self.read_into(memoryview(data)[len(head):])
+        except socket.error as ex:
+            print(ex)
+            status = False
+            size = len(head)
+        del data[size:]
+        return {"status": status, "data": data, "too_large": False}
+
+
+# Lee un unico mensaje HTTP de la conexion, terminando cuando se recibe
+# la cantidad de bytes indicada por Content-Length. Los mensajes de mas de
+# 'max_size' bytes no se leen y se retorna too_large.
+def read_message(conn, buffer_size, max_size=None):
+    return MessageReader(conn, buffer_size).read(max_size)
+
+
+# Cantidad maxima de partes que se pasan en una llamada a sendmsg.
+IOV_MAX = 1024
+
+
 def send_socket(conn, data):
     status = True
-    size = 0
-    msglen = len(data)
+    view = memoryview(data)
     try:
-        while size < msglen:
-            size += conn.send(data[size:])
+        while view:
+            view = view[conn.send(view):]
     except socket.error as ex:
         status = False
         print(ex)
     return {"status": status}
+
+
+# Envia las partes de 'parts' como un unico mensaje sin concatenarlas, con
+# sendmsg si esta disponible. Si una parte se envia a medias se continua
+# con una memoryview del resto, sin copiarla. Con report=False no se
+# imprimen los errores, para cuando se espera que el otro extremo pueda
+# cerrar la conexion.
+def send_parts(conn, parts, report=True):
+    status = True
+    views = [memoryview(part) for part in parts if len(part)]
+    try:
+        if not hasattr(conn, "sendmsg"):
+            for view in views:
+                while view:
+                    view = view[conn.send(view):]
+            return {"status": status}
+
+        first = 0
+        while first < len(views):
+            size = conn.sendmsg(views[first:first + IOV_MAX])
+            while first < len(views) and size >= len(views[first]):
+                size -= len(views[first])
+                first += 1
+            if size:
+                views[first] = views[first][size:]
+    except socket.error as ex:
+        status = False
+        if report:
+            print(ex)
+    return {"status": status}
@@ -0,0 +1,135 @@
+import time
+import bisect
+from threading import Lock
+
+# Limites superiores en segundos de los intervalos de los histogramas. El
+# ultimo intervalo no tiene limite.
+BOUNDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+# Etapas en las que se divide la atencion de un request.
+STAGES = ("read", "decode", "method", "encode", "queue", "send")
+
+
+# Mide el tiempo de cada etapa de un request. Cada llamada a 'lap' suma a
+# la etapa indicada el tiempo desde la llamada anterior.
+class StageTimer(object):
+    def __init__(self):
+        self.times = {}
+        self.mark = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.times[stage] = self.times.get(stage, 0) + now - self.mark
+        self.mark = now
+
+    # Vuelve a empezar a medir desde ahora, sin contar el tiempo anterior.
+    def restart(self):
+        self.mark = time.perf_counter()
+
+
+# Timer que no mide nada, para cuando las estadisticas estan desactivadas.
+class NullTimer(object):
+    def lap(self, stage):
+        pass
+
+    def restart(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # Estimacion del cuantil 'fraction': el limite del intervalo en el que
+    # cae, o el maximo si cae en el ultimo.
+    def quantile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BOUNDS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": list(self.buckets)
+        }
+
+
+class StageStats(object):
+    # Histogramas del tiempo de cada etapa y del total de los requests,
+    # por nombre de metodo. Los requests que tardan al menos 'slow_time'
+    # segundos se registran como lentos.
+
+    def __init__(self, slow_time=None):
+        self.slow_time = slow_time
+        self.methods = {}
+        self.lock = Lock()
+
+    def timer(self):
+        return StageTimer()
+
+    # Agrega los tiempos medidos por 'timer' para el metodo 'name' (None
+    # si el request no llego a invocar un metodo).
+    def record(self, name, timer):
+        name = name or "-"
+        total = sum(timer.times.values())
+        with self.lock:
+            histograms = self.methods.get(name)
+            if histograms is None:
+                histograms = self.methods[name] = {}
+            for stage, value in timer.times.items():
+                histogram = histograms.get(stage)
+                if histogram is None:
+                    histogram = histograms[stage] = Histogram()
+                histogram.add(value)
+            histogram = histograms.get("total")
+            if histogram is None:
+                histogram = histograms["total"] = Histogram()
+            histogram.add(total)
+
+        if self.slow_time is not None and total >= self.slow_time:
+            stages = " ".join(
+                "%s=%.1fms" % (stage, timer.times[stage] * 1e3)
+                for stage in STAGES if stage in timer.times
+            )
+            print("Request lento: %s %.1fms %s" % (name, total * 1e3, stages))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "bounds": list(BOUNDS),
+                "methods": {
+                    name: {
+                        stage: histogram.summary()
+                        for stage, histogram in histograms.items()
+                    }
+                    for name, histograms in self.methods.items()
+                }
+            }
+
+    def clear(self):
+        with self.lock:
+            self.methods.clear()
@@ -1,6 +1,10 @@
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 from datetime import datetime
+from collections import deque
+import tempfile
 import base64
+import re
 
 
 # -------------------
@@ -10,62 +14,202 @@ import base64
 # -------------------
 
 
-# Retorna un string que representa un valor en formato XMLRCP.
-# returna una etiqueta 'value'.
-def write_value(info):
+# Tamaño aproximado en caracteres de las partes que produce iter_value.
+CHUNK_SIZE = 65536
+
+# Tamaño en bytes a partir del cual los valores base64 que se reciben como
+# archivos se guardan en disco en lugar de en memoria.
+SPOOL_SIZE = 1024 * 1024
+
+
+# Marca para diferenciar las etiquetas pendientes de los strings a
+# codificar dentro de la pila de iter_value.
+class Markup(str):
+    pass
+
+
+STRUCT_END = Markup("</struct></value>")
+ARRAY_END = Markup("</data></array></value>")
+MEMBER_END = Markup("</member>")
+
+# Indica que el siguiente elemento de la pila es el nombre de un member.
+MEMBER_START = Markup("<member>")
+
+
+# Retorna el contenido de la etiqueta 'value' para valores escalares, o
+# None si el valor es un struct o un array.
+def write_scalar(info):
     if type(info) is str:
-        ret = "<string>" + info + "</string>"
+        return "<string>" + escape(info) + "</string>"
     elif type(info) is int:
-        ret = "<int>" + str(info) + "</int>"
+        return "<int>" + str(info) + "</int>"
     elif type(info) is bool:
-        ret = "<boolean>" + str(info).lower() + "</boolean>"
+        return "<boolean>" + str(info).lower() + "</boolean>"
     elif type(info) is float:
-        ret = "<double>" + str(info) + "</double>"
+        return "<double>" + str(info) + "</double>"
     elif type(info) is datetime:
-        ret = "<dateTime.iso8601>" + info.isoformat() + "</dateTime.iso8601>"
+        return "<dateTime.iso8601>" + info.isoformat() + "</dateTime.iso8601>"
     elif type(info) is bytes:
-        ret = "<base64>" + info.decode() + "</base64>"
-    elif type(info) is dict:
-        ret = "<struct>"
-        for key in info:
-            ret += "<member><name>" + key + "</name>"
-            ret += write_value(info[key])
-            ret += "</member>"
-        ret += "</struct>"
-    elif type(info) in [list, tuple]:
-        ret = ""
-        for key in info:
-            ret += write_value(key)
-        ret = "<array><data>" + ret + "</data></array>"
-    else:
-        raise Exception()
-    return "<value>" + ret + "</value>"
+        return "<base64>" + base64.b64encode(info).decode() + "</base64>"
+    elif type(info) is dict or type(info) in [list, tuple]:
+        return None
+    raise Exception()
 
 
-# funcion que retorna un XMLRPC que representa una consulta de
-# una operacion.
-def write_xmlrpc_request(params, method):
+# Indica si 'info' es un archivo (abierto en modo binario), que se envia
+# como un valor base64 con su contenido.
+def is_file(info):
+    return hasattr(info, "read")
+
+
+# Generador que retorna por partes el texto base64 de 'info', un bytes o
+# un archivo, sin codificarlo completo. Los archivos se leen desde su
+# posicion actual y se vuelven a ella al terminar si lo permiten, para
+# poder codificarlos de nuevo (por ejemplo al reintentar una llamada).
+def iter_base64(info, chunk_size=CHUNK_SIZE):
+    size = max(chunk_size // 4, 1) * 3
+    if not is_file(info):
+        view = memoryview(info)
+        for pos in range(0, len(view), size):
+            yield base64.b64encode(view[pos:pos + size]).decode()
+        return
+
+    start = info.tell() if info.seekable() else None
+    try:
+        # Cada parte se codifica con un multiplo de 3 bytes para que no
+        # lleve relleno, aunque 'read' retorne menos de lo pedido.
+        pending = b""
+        data = info.read(size)
+        while data:
+            data = pending + data
+            end = len(data) - len(data) % 3
+            if end:
+                yield base64.b64encode(data[:end]).decode()
+            pending = data[end:]
+            data = info.read(size)
+        if pending:
+            yield base64.b64encode(pending).decode()
+    finally:
+        if start is not None:
+            info.seek(start)
+
+
+# Generador que retorna por partes el string que representa un valor en
+# formato XMLRCP (una etiqueta 'value'). Los structs y arrays se recorren
+# con una pila en lugar de recursion, y las partes se juntan hasta tener
+# al menos 'chunk_size' caracteres.
+def iter_value(info, chunk_size=CHUNK_SIZE):
+    parts = []
+    size = 0
+    stack = [info]
+    while stack:
+        info = stack.pop()
+        if info is MEMBER_START:
+            part = "<member><name>" + escape(stack.pop()) + "</name>"
+        elif type(info) is Markup:
+            part = info
+        elif type(info) is bytes or is_file(info):
+            # Los valores base64 se codifican de a partes, sin armar el
+            # texto completo.
+            parts.append("<value><base64>")
+            for part in iter_base64(info, chunk_size):
+                parts.append(part)
+                size += len(part)
+                if size >= chunk_size:
+                    yield "".join(parts)
+                    parts = []
+                    size = 0
+            part = "</base64></value>"
+        else:
+            part = write_scalar(info)
+            if part is not None:
+                part = "<value>" + part + "</value>"
+            elif type(info) is dict:
+                stack.append(STRUCT_END)
+                for key in reversed(info):
+                    stack.append(MEMBER_END)
+                    stack.append(info[key])
+                    stack.append(key)
+                    stack.append(MEMBER_START)
+                part = "<value><struct>"
+            else:
+                stack.append(ARRAY_END)
+                stack.extend(reversed(info))
+                part = "<value><array><data>"
+
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(parts)
+            parts = []
+            size = 0
+
+    if parts:
+        yield "".join(parts)
+
+
+# Retorna un string que representa un valor en formato XMLRCP.
+# returna una etiqueta 'value'.
+def write_value(info):
+    return "".join(iter_value(info))
+
+
+# Generador que retorna en bytes y por partes el XMLRPC que representa
+# una consulta de una operacion.
+def iter_xmlrpc_request(params, method, chunk_size=CHUNK_SIZE):
     ret = '<?xml version="1.0"?><methodCall>'
-    ret += '<methodName>' + method + '</methodName>'
+    ret += '<methodName>' + escape(method) + '</methodName>'
     ret += '<params>'
+    yield ret.encode()
     for param in params:
-        ret += '<param>' + write_value(param) + '</param>'
-    ret += '</params>'
-    ret += '</methodCall>'
-    return ret.encode()
+        yield '<param>'.encode()
+        for part in iter_value(param, chunk_size):
+            yield part.encode()
+        yield '</param>'.encode()
+    yield '</params></methodCall>'.encode()
+
+
+# funcion que retorna un XMLRPC que representa una consulta de
+# una operacion.
+def write_xmlrpc_request(params, method):
+    return b"".join(iter_xmlrpc_request(params, method))
+
+
+# Generador que retorna en bytes y por partes el XMLRPC con el resultado
+# de una operacion, para enviarlo sin armar el mensaje completo.
+def iter_xmlrpc_response(result, chunk_size=CHUNK_SIZE):
+    yield "<?xml version='1.0'?><methodResponse><params><param>".encode()
+    for part in iter_value(result, chunk_size):
+        yield part.encode()
+    yield "</param></params></methodResponse>".encode()
 
 
 # funcion que retorna un XMLRPC con el resultado de una operacion.
 def write_xmlrpc_response(result):
-    ret = "<?xml version='1.0'?><methodResponse>"
-    ret += '<params><param>' + write_value(result) + '</param></params>'
-    ret += "</methodResponse>"
-    return ret.encode()
+    return b"".join(iter_xmlrpc_response(result))
+
+
+# Mensajes de error de cada codigo de fault.
+FAULT_STRINGS = {
+    1: "Error parseo de XML.",
+    2: "No existe el método invocado.",
+    3: "Error en parámetros del método invocado.",
+    4: "Error interno en la ejecución del método.",
+    5: "Otros errores.",
+}
 
 
 # funcion que retorna un XMLRPC erroneo con el codigo y mensaje
-# de error correspondiente.
+# de error correspondiente. Los de los codigos conocidos se arman una
+# unica vez, en FAULT_BODIES.
 def write_xmlrpc_error(code):
+    body = FAULT_BODIES.get(code)
+    if body is None:
+        body = build_xmlrpc_error(code)
+    return body
+
+
+def build_xmlrpc_error(code):
     ret = ET.Element("methodResponse")
     body = ET.SubElement(ret, "fault")
     body = ET.SubElement(body, "value")
@@ -79,20 +223,41 @@ def write_xmlrpc_error(code):
     ET.SubElement(mem, "name").text = "faultString"
     mem = ET.SubElement(ET.SubElement(mem, "value"), "string")
 
-    if code == 1:
-        mem.text = "Error parseo de XML."
-    elif code == 2:
-        mem.text = "No existe el método invocado."
-    elif code == 3:
-        mem.text = "Error en parámetros del método invocado."
-    elif code == 4:
-        mem.text = "Error interno en la ejecución del método."
-    elif code == 5:
-        mem.text = "Otros errores."
+    mem.text = FAULT_STRINGS.get(code)
 
     return ET.tostring(ret, encoding="utf-8", xml_declaration=True)
 
 
+FAULT_BODIES = {code: build_xmlrpc_error(code) for code in FAULT_STRINGS}
+
+
+# Retorna el struct de un fault, para incluirlo dentro de otro valor (por
+# ejemplo en el resultado de system.multicall).
+def fault_value(code):
+    return {"faultCode": code, "faultString": FAULT_STRINGS.get(code)}
+
+
+VALUE_TYPES = [str, int, bool, float, datetime, bytes]
+
+
+# Comprueba que 'info' solo contenga valores que se pueden codificar,
+# recorriendo los structs y arrays con una pila.
+def check_value(info):
+    stack = [info]
+    while stack:
+        info = stack.pop()
+        if type(info) is dict:
+            for key in info:
+                if type(key) is not str:
+                    return False
+            stack.extend(info.values())
+        elif type(info) in [list, tuple]:
+            stack.extend(info)
+        elif type(info) not in VALUE_TYPES and not is_file(info):
+            return False
+    return True
+
+
 # -------------------
 # |     Lectura     |
 # |       de        |
@@ -100,111 +265,343 @@ def write_xmlrpc_error(code):
 # -------------------
 
 
-# Computa la lectura de valores en un xml con estructura XMLRPC.
-# Solamente funciona para las etiquetas 'value'.
-def read_value(value):
-    if len(value) == 0:
-        return value.text
-    elif len(value) == 1:
-        if value[0].tag == "struct":
-            ret = {}
-            for elem in value[0]:
-                if elem.tag != "member" or len(elem) != 2:
-                    raise Exception()
-                name = elem.find("name")
-                value = elem.find("value")
-                if len(name) != 0:
-                    raise Exception()
-                ret.update({name.text: read_value(value)})
-            return ret
-        if value[0].tag == "array" and len(value[0]) == 1 and value[0][0].tag == "data":
-            ret = []
-            for elem in value[0][0]:
-                if elem.tag != "value":
-                    raise Exception()
-                ret.append(read_value(elem))
-            return ret
-        elif len(value[0]) == 0:
-            if value[0].tag == "string":
-                return value[0].text
-            elif value[0].tag in ["i4", "int"]:
-                return int(value[0].text)
-            elif value[0].tag == "boolean":
-                if value[0].text == "true":
-                    return True
-                elif value[0].text == "false":
-                    return False
-            elif value[0].tag == "double":
-                return float(value[0].text)
-            elif value[0].tag == "dateTime.iso8601":
-                return datetime.fromisoformat(value[0].text)
-            elif value[0].tag == "base64":
-                ret = value[0].text.encode()
-                base64.b64decode(ret)   # lanza error si no es base64.
-                return ret
-
+SCALAR_TAGS = {
+    "string", "i4", "int", "boolean", "double", "dateTime.iso8601", "base64"
+}
+
+
+# Computa el valor de una etiqueta escalar a partir de su texto.
+def read_scalar(tag, text):
+    if tag == "string":
+        return text
+    elif tag in ["i4", "int"]:
+        return int(text)
+    elif tag == "boolean":
+        if text == "true":
+            return True
+        elif text == "false":
+            return False
+    elif tag == "double":
+        return float(text)
+    elif tag == "dateTime.iso8601":
+        return datetime.fromisoformat(text)
+    elif tag == "base64":
+        return base64.b64decode((text or "").encode())
     raise Exception()
 
 
-# lee mensaje XMLRPC response y retorna los datos y tipo de mensaje, donde
-# False representa un response correcto y True representa un falut.
-def read_xmlrpc_response(data):
-    data = ET.fromstring(data)
-    if len(data) != 1 or data.tag != "methodResponse":
-        raise Exception()
-
-    data = data[0]
-    ret = {}
-    if data.tag == "fault":
-        data = data[0]
-        ret = read_value(data)
-
-        if type(ret["faultCode"]) is not int:
-            raise Exception()
-        if type(ret["faultString"]) is not str:
+# Crea el archivo temporal en el que se guarda un valor base64 que se
+# recibe como archivo.
+def spool_file():
+    return tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+
+
+# Reemplaza los valores bytes de 'info' (una lista o un struct), a
+# cualquier profundidad, por archivos temporales con su contenido. Los
+# archivos creados se agregan a 'opened'.
+def spool_values(info, opened):
+    stack = [info]
+    while stack:
+        container = stack.pop()
+        if type(container) is dict:
+            keys = list(container)
+        else:
+            keys = range(len(container))
+        for key in keys:
+            value = container[key]
+            if type(value) is bytes:
+                file = spool_file()
+                opened.append(file)
+                file.write(value)
+                file.seek(0)
+                container[key] = file
+            elif type(value) in [list, dict]:
+                stack.append(value)
+
+
+# Caracteres que se ignoran dentro del texto base64.
+BASE64_SPACES = b" \t\r\n"
+
+
+# Decodificador incremental de base64. Los datos decodificados se
+# escriben en 'file' si se indica, o si no se juntan para retornarlos
+# como bytes en 'close'.
+class Base64Decoder(object):
+    def __init__(self, file=None):
+        self.file = file
+        self.parts = []
+        self.pending = b""
+
+    # Se decodifican los grupos de 4 caracteres completos, y el resto
+    # queda pendiente para la siguiente parte.
+    def feed(self, data):
+        data = self.pending + bytes(data).translate(None, BASE64_SPACES)
+        end = len(data) - len(data) % 4
+        self.pending = data[end:]
+        if end:
+            data = base64.b64decode(data[:end])
+            if self.file is None:
+                self.parts.append(data)
+            else:
+                self.file.write(data)
+
+    def close(self):
+        if self.pending:
             raise Exception()
-        if len(ret) != 2:
+        if self.file is None:
+            return b"".join(self.parts)
+        self.file.seek(0)
+        return self.file
+
+
+# Etiqueta cuyo texto se decodifica fuera del parser XML, y texto que se
+# le pasa al parser en su lugar.
+BASE64_TAG = b"<base64>"
+BASE64_START = re.compile(re.escape(BASE64_TAG))
+BASE64_END = re.compile(b"<")
+BASE64_MARK = "#"
+
+
+# Retorna la cantidad de bytes al final de 'data' que pueden ser el
+# principio de BASE64_TAG.
+def partial_tag(data):
+    for size in range(min(len(BASE64_TAG) - 1, len(data)), 0, -1):
+        if data[len(data) - size:] == BASE64_TAG[:size]:
+            return size
+    return 0
+
+
+# Decodificador incremental de mensajes XMLRPC. Se le pasan las partes
+# del mensaje con 'feed' a medida que llegan, y los valores se construyen
+# al terminar cada etiqueta 'value', struct o array, descartando los
+# elementos ya leidos. 'close' retorna el resultado en el mismo formato
+# que read_xmlrpc_request o read_xmlrpc_response, segun 'root'.
+#
+# El texto de los valores base64 no pasa por el parser XML, sino que se
+# decodifica a medida que llega. 'files' es una funcion que recibe el
+# nombre del metodo (None en los responses) e indica si esos valores se
+# retornan como archivos temporales en lugar de bytes; los archivos
+# creados quedan en 'opened' para cerrarlos cuando ya no se usen.
+class XmlRpcParser(object):
+    def __init__(self, root, files=None):
+        self.root = root
+        self.files = files
+        self.parser = ET.XMLPullParser(events=("end", ))
+        self.values = []
+        self.result = None
+        self.error = None
+        self.method = None
+
+        # Valores base64 ya decodificados en orden, decodificador del que
+        # se esta leyendo, y final de la ultima parte que puede ser el
+        # principio de una etiqueta base64.
+        self.binaries = deque()
+        self.base64 = None
+        self.pending = b""
+        self.opened = []
+
+    # Los errores se guardan y se lanzan en 'close', para que se pueda
+    # seguir leyendo el resto del mensaje desde el socket.
+    def feed(self, data):
+        if self.error is not None:
+            return
+        try:
+            self.split_base64(data)
+        except Exception as ex:
+            self.error = ex
+
+    # Separa de 'data' el texto de los valores base64, que se le pasa al
+    # decodificador, y el resto, que se le pasa al parser XML.
+    def split_base64(self, data):
+        if self.pending:
+            data = self.pending + data
+            self.pending = b""
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            if self.base64 is not None:
+                match = BASE64_END.search(data, pos)
+                end = len(data) if match is None else match.start()
+                self.base64.feed(data[pos:end])
+                pos = end
+                if match is not None:
+                    self.binaries.append(self.base64.close())
+                    self.base64 = None
+                    self.feed_xml(BASE64_MARK.encode())
+                continue
+
+            match = BASE64_START.search(data, pos)
+            if match is None:
+                end = len(data) - partial_tag(data[pos:])
+                self.feed_xml(data[pos:end])
+                self.pending = bytes(data[end:])
+                return
+            self.feed_xml(data[pos:match.end()])
+            file = None
+            if self.files is not None and self.files(self.method):
+                file = spool_file()
+                self.opened.append(file)
+            self.base64 = Base64Decoder(file)
+            pos = match.end()
+
+    # Los datos se procesan de a partes para no acumular los elementos de
+    # todo el mensaje antes de leer los eventos.
+    def feed_xml(self, data):
+        for pos in range(0, len(data), CHUNK_SIZE):
+            self.parser.feed(data[pos:pos + CHUNK_SIZE])
+            self.read_events()
+
+    def close(self):
+        if self.error is None:
+            try:
+                if self.base64 is not None:
+                    raise Exception()
+                self.feed_xml(self.pending)
+                self.parser.close()
+                self.read_events()
+            except Exception as ex:
+                self.error = ex
+        if self.error is not None:
+            raise self.error
+        if self.result is None:
             raise Exception()
+        return self.result
+
+    # Los valores leidos se apilan en 'values' hasta que termina la
+    # etiqueta que los contiene.
+    def read_events(self):
+        values = self.values
+        for _, elem in self.parser.read_events():
+            tag = elem.tag
+            if tag == "value":
+                values.append(self.read_value(elem))
+            elif tag == "data":
+                for child in elem:
+                    if child.tag != "value":
+                        raise Exception()
+                count = len(elem)
+                ret = values[len(values) - count:]
+                del values[len(values) - count:]
+                values.append(ret)
+            elif tag == "struct":
+                values.append(self.read_struct(elem))
+            elif tag == self.root:
+                self.result = self.read_root(elem)
+            elif tag == "methodName":
+                self.method = elem.text
+                continue
+            else:
+                continue
+            elem.clear()
+
+    # Computa la lectura de una etiqueta 'value'. Los structs y arrays ya
+    # fueron leidos y estan en el tope de la pila.
+    def read_value(self, value):
+        if len(value) == 0:
+            return value.text
+        elif len(value) == 1:
+            elem = value[0]
+            if elem.tag == "struct":
+                return self.values.pop()
+            elif elem.tag == "array" and len(elem) == 1 and elem[0].tag == "data":
+                return self.values.pop()
+            elif elem.tag == "base64" and len(elem) == 0:
+                return self.read_base64(elem.text)
+            elif elem.tag in SCALAR_TAGS and len(elem) == 0:
+                return read_scalar(elem.tag, elem.text)
+        raise Exception()
 
-        ret["type"] = True
-
-    elif data.tag == "params":
-        elem = data[0]
-        if len(elem) != 1 or elem.tag != "param":
+    # El texto de los valores base64 ya se decodifico en split_base64 y en
+    # su lugar esta BASE64_MARK. Si no, por ejemplo si la etiqueta tiene
+    # atributos, se decodifica aca.
+    def read_base64(self, text):
+        if text == BASE64_MARK:
+            return self.binaries.popleft()
+        file = None
+        if self.files is not None and self.files(self.method):
+            file = spool_file()
+            self.opened.append(file)
+        decoder = Base64Decoder(file)
+        decoder.feed((text or "").encode())
+        return decoder.close()
+
+    # Computa la lectura de un struct. El valor de cada member ya fue
+    # leido y esta en la pila, en el mismo orden.
+    def read_struct(self, struct):
+        names = []
+        for elem in struct:
+            if elem.tag != "member" or len(elem) != 2:
+                raise Exception()
+            if elem[0].tag == "name" and elem[1].tag == "value":
+                name = elem[0]
+            elif elem[0].tag == "value" and elem[1].tag == "name":
+                name = elem[1]
+            else:
+                raise Exception()
+            if len(name) != 0:
+                raise Exception()
+            names.append(name.text)
+
+        values = self.values[len(self.values) - len(names):]
+        del self.values[len(self.values) - len(names):]
+        return dict(zip(names, values))
+
+    def read_root(self, elem):
+        if elem.tag == "methodCall":
+            if len(elem) != 2:
+                raise Exception()
+            method = elem.find("methodName")
+            params = elem.find("params")
+            if method is None or params is None or len(method) != 0:
+                raise Exception()
+            for param in params:
+                if param.tag != "param" or len(param) != 1 or param[0].tag != "value":
+                    raise Exception()
+            if len(self.values) != len(params):
+                raise Exception()
+            return {
+                "method": method.text,
+                "params": self.values
+            }
+
+        if len(elem) != 1 or len(self.values) != 1:
+            raise Exception()
+        elem = elem[0]
+        ret = {}
+        if elem.tag == "fault":
+            if len(elem) != 1 or elem[0].tag != "value":
+                raise Exception()
+            ret = self.values.pop()
+            if type(ret) is not dict or len(ret) != 2:
+                raise Exception()
+            if type(ret.get("faultCode")) is not int:
+                raise Exception()
+            if type(ret.get("faultString")) is not str:
+                raise Exception()
+            ret["type"] = True
+        elif elem.tag == "params":
+            if len(elem) != 1 or elem[0].tag != "param":
+                raise Exception()
+            if len(elem[0]) != 1 or elem[0][0].tag != "value":
+                raise Exception()
+            ret["type"] = False
+            ret["data"] = self.values.pop()
+        else:
             raise Exception()
+        return ret
 
-        ret["type"] = False
-        ret["data"] = read_value(elem[0])
-    else:
-        raise Exception()
 
-    return ret
+# lee mensaje XMLRPC response y retorna los datos y tipo de mensaje, donde
+# False representa un response correcto y True representa un falut.
+def read_xmlrpc_response(data):
+    parser = XmlRpcParser("methodResponse")
+    parser.feed(data)
+    return parser.close()
 
 
 # lee mensaje XMLRPC request y retorna los el nombre del
 # metodo y una lista con los parametros de ejecucion.
 def read_xmlrpc_request(data):
-    elem = ET.fromstring(data)
-    if len(elem) != 2:
-        raise Exception()
-    if elem.find("methodName") is None:
-        raise Exception()
-    if elem.find("params") is None:
-        raise Exception()
-
-    method = elem.find("methodName")
-    if len(method) != 0:
-        raise Exception()
-    method = method.text
-
-    params = elem.find("params")
-    params_list = []
-    for param in params:
-        if param.tag != "param" or len(param) != 1 or param[0].tag != "value":
-            raise Exception()
-        params_list.append(read_value(param[0]))
-
-    return {
-        "method": method,
-        "params": params_list
-    }
+    parser = XmlRpcParser("methodCall")
+    parser.feed(data)
+    return parser.close()
@@ -58,6 +58,7 @@ import pox.openflow.libopenflow_01 as of
 import threading
 import os
 import sys
+import struct
 from errno import EAGAIN, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL, EMFILE
 
 
@@ -733,6 +734,14 @@ class Connection (EventMixin):
 
   _aborted_connections = 0
 
+  # Maximum number of bytes read from the switch socket in each read().
+  # The receive buffer grows as needed to hold at least this much free
+  # space after any pending partial message.
+  read_size = 65536
+
+  # OpenFlow header fields we need to frame messages (version, type, length)
+  _header = struct.Struct("!BBH")
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -749,7 +758,12 @@ class Connection (EventMixin):
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = b''
+
+    # Receive buffer.  Unprocessed data lives in buf[_buf_start:_buf_end];
+    # new data is received directly into the free space after it.
+    self.buf = bytearray(self.read_size)
+    self._buf_start = 0
+    self._buf_end = 0
     Connection.ID += 1
     self.ID = Connection.ID
 
@@ -892,40 +906,53 @@ class Connection (EventMixin):
 
     Note: This function will block if data is not available.
     """
+    buf = self.buf
+    start = self._buf_start
+    end = self._buf_end
+
+    # Make room for a full read.  Only the pending partial message (if any)
+    # is moved to the front, and the buffer only grows when that is not
+    # enough.
+    if len(buf) - end < self.read_size:
+      if start != 0:
+        buf[0:end-start] = buf[start:end]
+        end -= start
+        start = 0
+      if len(buf) - end < self.read_size:
+        buf.extend(b'\x00' * (self.read_size - (len(buf) - end)))
+
     try:
-      d = self.sock.recv(2048)
+      view = memoryview(buf)
+      d = self.sock.recv_into(view[end:], self.read_size)
     except:
       return False
-    if len(d) == 0:
+    if d == 0:
       return False
-    self.buf += d
-    buf_len = len(self.buf)
-
+    end += d
 
-    offset = 0
-    while buf_len - offset >= 8: # 8 bytes is minimum OF message size
-      # We pull the first four bytes of the OpenFlow header off by hand
-      # (using ord) to find the version/length/type so that we can
-      # correctly call libopenflow to unpack it.
+    offset = start
+    while end - offset >= 8: # 8 bytes is minimum OF message size
+      # We pull the version/type/length out of the OpenFlow header by hand
+      # so that we can correctly call libopenflow to unpack it.
+      version, ofp_type, msg_length = self._header.unpack_from(buf, offset)
 
-      ofp_type = ord(self.buf[offset+1])
-
-      if ord(self.buf[offset]) != of.OFP_VERSION:
+      if version != of.OFP_VERSION:
         if ofp_type == of.OFPT_HELLO:
           # We let this through and hope the other side switches down.
           pass
         else:
           log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
+                      % (version, self))
           return False # Throw connection away
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
-
-      if buf_len - offset < msg_length: break
+      if end - offset < msg_length: break
 
-      new_offset,msg = self.unpackers[ofp_type](self.buf, offset)
-      assert new_offset - offset == msg_length
-      offset = new_offset
+      # libopenflow works on byte strings, so each message is copied out of
+      # the buffer on its own; the rest of the buffer is left in place.
+      new_offset,msg = self.unpackers[ofp_type](
+          view[offset:offset+msg_length].tobytes(), 0)
+      assert new_offset == msg_length
+      offset += msg_length
 
       try:
         h = self.handlers[ofp_type]
@@ -936,8 +963,13 @@ class Connection (EventMixin):
                       ("\n" + str(self) + " ").join(str(msg).split('\n')))
         continue
 
-    if offset != 0:
-      self.buf = self.buf[offset:]
+    if offset == end:
+      # Everything was consumed, so the next read starts at the front.
+      self._buf_start = 0
+      self._buf_end = 0
+    else:
+      self._buf_start = offset
+      self._buf_end = end
 
     return True
 
@@ -1188,7 +1220,7 @@ deferredSender = None
 
 def launch (port=6633, address="0.0.0.0", name=None,
             private_key=None, certificate=None, ca_cert=None,
-            __INSTANCE__=None):
+            read_size=None, __INSTANCE__=None):
   """
   Start a listener for OpenFlow connections
 
@@ -1196,7 +1228,12 @@ def launch (port=6633, address="0.0.0.0", name=None,
   combinations and pointing to reasonable key/cert files.  These have the same
   meanings as with Open vSwitch's old test controller, but they are more
   flexible (e.g., ca-cert can be skipped).
+
+  read_size sets how many bytes are read from a switch socket at a time.
   """
+  if read_size is not None:
+    Connection.read_size = int(read_size)
+
   if name is None:
     basename = "of_01"
     counter = 1